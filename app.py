@@ -1,22 +1,70 @@
-from flask import Flask, jsonify, send_from_directory, request
+from flask import Flask, Response, g, has_request_context, jsonify, send_from_directory, request
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from urllib.parse import unquote
-from datetime import timedelta
-from sqlalchemy import func
+from werkzeug.exceptions import NotFound
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import case, event, func, insert, literal, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import inspect as sa_inspect
 import os
 import json
+import bisect
+import difflib
+import hashlib
 import re
 import time
+import socket
 import threading
-import google.generativeai as genai
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, OperationalError
 import random
+import math
+import heapq
+from collections import Counter, OrderedDict, defaultdict
 import requests
+import bcrypt
+import multiprocessing
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import base64 # <-- NEW
+import click
+import io
+import shutil
+import subprocess
+import gzip
+import atexit
+import mimetypes
+
+try:
+    from PIL import Image, ImageOps # Optional: avatar and cover thumbnails
+except ImportError:
+    Image = ImageOps = None
+
+try:
+    from mutagen.id3 import ID3 # Optional: embedded cover art in the thumbnail stage
+except ImportError:
+    ID3 = None
+
+try:
+    import brotli # Optional: .br variants in `flask build-static`
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl # POSIX only: init lock for SQLite
+except ImportError:
+    fcntl = None
 
 # Load environment variables
 load_dotenv()
@@ -45,49 +93,212 @@ app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024 # 5MB Limit for Uploads
 
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 
-# Configure AI
+# Behind a reverse proxy (Render), set PROXY_HOPS=1 so request.remote_addr is the client, not the proxy
+PROXY_HOPS = int(os.environ.get('PROXY_HOPS', 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
+
+# Rate limits (login/signup). Counters are per process unless RATELIMIT_STORAGE_URI points at
+# a shared store, e.g. redis://...; RATELIMIT_ENABLED=0 turns limiting off (benchmarks).
+app.config['RATELIMIT_STORAGE_URI'] = os.environ.get('RATELIMIT_STORAGE_URI', 'memory://')
+app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', '1') != '0'
+app.config['RATELIMIT_HEADERS_ENABLED'] = True
+limiter = Limiter(get_remote_address, app=app)
+
+# Configure AI (the SDK is imported on first use, not at worker boot)
 ai_model_name = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-if os.getenv("GOOGLE_API_KEY"):
-    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-    model = genai.GenerativeModel(ai_model_name)
-else:
+GEMINI_TIMEOUT = float(os.environ.get('GEMINI_TIMEOUT', 20)) # seconds; a stuck call is abandoned, not waited on
+if not os.getenv("GOOGLE_API_KEY"):
     print("WARNING: GOOGLE_API_KEY not found. AI features will fail.")
-    model = None
+model = None # Created by get_model(); tests can assign a stub here
+_model_lock = threading.Lock()
 
-db = SQLAlchemy(app, engine_options={
+def get_model():
+    global model
+    if model is None and os.getenv("GOOGLE_API_KEY"):
+        with _model_lock:
+            if model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+                model = genai.GenerativeModel(ai_model_name)
+    return model
+
+# Connection pool sized for threaded workers (gunicorn.conf.py): one connection per serving
+# thread plus headroom for background jobs. A request that waits DB_POOL_TIMEOUT seconds for a
+# connection fails instead of queueing forever; Postgres statements are capped at DB_STATEMENT_TIMEOUT_MS.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', os.environ.get('GUNICORN_THREADS', 8)))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 4))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 15000))
+
+engine_options = {
     "pool_pre_ping": True,
     "pool_recycle": 300,
-})
-bcrypt = Bcrypt(app)
+}
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+    engine_options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+                          connect_args={'connect_timeout': 10, 'options': f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"})
+db = SQLAlchemy(app, engine_options=engine_options)
 jwt = JWTManager(app)
 
+# --- INSTRUMENTATION ---
+# Per-route request latency, DB query count / time and external call time (Gemini, Deezer),
+# aggregated into histograms and exposed at /metrics in Prometheus text format.
+# Numbers are per process (each gunicorn worker keeps its own).
+# SLOW_REQUEST_MS=<ms> turns on a log of slow requests including their SQL.
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 0)) or None
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, labels):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {} # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                base = ','.join(f'{k}="{_prom_escape(v)}"' for k, v in zip(self.labels, label_values))
+                sep = ',' if base else ''
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {series[-1]}')
+                lines.append(f'{self.name}_sum{{{base}}} {series[-2]}')
+                lines.append(f'{self.name}_count{{{base}}} {series[-1]}')
+        return lines
+
+def _prom_escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+REQUEST_SECONDS = Histogram('rhymic_request_duration_seconds', 'Total request latency.', LATENCY_BUCKETS, ('route', 'method', 'status'))
+REQUEST_QUERIES = Histogram('rhymic_request_db_queries', 'SQL statements per request.', QUERY_COUNT_BUCKETS, ('route',))
+REQUEST_DB_SECONDS = Histogram('rhymic_request_db_seconds', 'Time spent in SQL per request.', LATENCY_BUCKETS, ('route',))
+REQUEST_EXTERNAL_SECONDS = Histogram('rhymic_request_external_seconds', 'Time spent in external calls per request.', LATENCY_BUCKETS, ('route', 'service'))
+EXTERNAL_CALL_SECONDS = Histogram('rhymic_external_call_seconds', 'External call latency (requests and background jobs).', LATENCY_BUCKETS, ('service', 'outcome'))
+METRIC_HISTOGRAMS = [REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_DB_SECONDS, REQUEST_EXTERNAL_SECONDS, EXTERNAL_CALL_SECONDS]
+
+def _request_stats():
+    return g.get('request_stats') if has_request_context() else None
+
+@contextmanager
+def track_external(service):
+    """Times an outbound call ('gemini', 'deezer', 'bcrypt' pool); attributed to the current request when there is one."""
+    t0 = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        EXTERNAL_CALL_SECONDS.observe(elapsed, service, outcome)
+        stats = _request_stats()
+        if stats is not None:
+            stats['external'][service] += elapsed
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    stats = _request_stats()
+    if stats is None: return
+    stats['queries'] += 1
+    stats['db_time'] += elapsed
+    if SLOW_REQUEST_MS:
+        stats['statements'].append((round(elapsed * 1000, 2), statement[:500]))
+
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+
+@app.before_request
+def start_request_stats():
+    g.request_stats = {'start': time.perf_counter(), 'queries': 0, 'db_time': 0.0,
+                       'external': defaultdict(float), 'statements': []}
+
+@app.after_request
+def record_request_stats(response):
+    stats = _request_stats()
+    if stats is None: return response
+    total = time.perf_counter() - stats['start']
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+
+    REQUEST_SECONDS.observe(total, route, request.method, str(response.status_code))
+    REQUEST_QUERIES.observe(stats['queries'], route)
+    REQUEST_DB_SECONDS.observe(stats['db_time'], route)
+    for service, seconds in stats['external'].items():
+        REQUEST_EXTERNAL_SECONDS.observe(seconds, route, service)
+
+    if SLOW_REQUEST_MS and total * 1000 >= SLOW_REQUEST_MS:
+        print(f"Slow Request: {request.method} {request.path} -> {response.status_code} in {total * 1000:.1f}ms "
+              f"({stats['queries']} queries, db {stats['db_time'] * 1000:.1f}ms, "
+              f"external {dict((k, round(v * 1000, 1)) for k, v in stats['external'].items())})")
+        for ms, statement in stats['statements']:
+            print(f"   [{ms}ms] {' '.join(statement.split())}")
+    return response
+
 # --- DATABASE MODELS ---
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password = db.Column(db.String(60), nullable=False)
-    profile_pic = db.Column(db.Text, default=None)
+    profile_pic = db.deferred(db.Column(db.Text, default=None)) # Loaded only when asked for (legacy rows may still hold a data URI)
 
 class Song(db.Model):
+    __table_args__ = (
+        db.Index('ix_song_artist', 'artist'), # Artist-image lookups only resolve library artists
+    )
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(150), nullable=False)
     artist = db.Column(db.String(100), default="Unknown Artist")
     src = db.Column(db.String(300), nullable=False, unique=True)
     cover = db.Column(db.String(300), default="/assets/default_cover.jpg")
+    duration = db.Column(db.Float, nullable=True) # seconds, from the transcode stage
+    loudness = db.Column(db.Float, nullable=True) # integrated loudness (LUFS, EBU R128)
+    cover_hash = db.Column(db.String(64), nullable=True) # sha256 of the cover art behind the thumbnails (None = pending, '' = none)
 
 class Playlist(db.Model):
+    __table_args__ = (
+        db.Index('ix_playlist_user', 'user_id'),
+        db.Index('ix_playlist_system', 'is_system'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     is_system = db.Column(db.Boolean, default=False)
 
 class PlaylistSong(db.Model):
+    # Songs in a playlist are ordered by PlaylistSong.id (insertion order)
+    __table_args__ = (
+        db.Index('uq_playlist_song', 'playlist_id', 'song_id', unique=True),
+        db.Index('ix_playlist_song_song', 'song_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     playlist_id = db.Column(db.Integer, db.ForeignKey('playlist.id'), nullable=False)
     song_id = db.Column(db.Integer, db.ForeignKey('song.id'), nullable=False)
 
 class LikedSong(db.Model):
+    __table_args__ = (
+        db.Index('uq_liked_song', 'user_id', 'song_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     song_id = db.Column(db.Integer, db.ForeignKey('song.id'), nullable=False)
@@ -96,187 +307,1630 @@ class LikedSong(db.Model):
 class ArtistImage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     artist_name = db.Column(db.String(100), unique=True, nullable=False)
-    image_url = db.Column(db.String(500), nullable=False)
+    image_url = db.Column(db.String(500), nullable=False) # '' = Deezer had no picture (negative cache)
+    checked_at = db.Column(db.DateTime, default=None)
+
+# NEW MODEL: Content-addressed blobs (default blob store backend)
+class Blob(db.Model):
+    key = db.Column(db.String(200), primary_key=True)
+    content_type = db.Column(db.String(100), nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+# NEW MODEL: Manifest of scanned audio files (lets the scanner skip unchanged files)
+class LibraryFile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(300), unique=True, nullable=False) # Same value as Song.src
+    mtime = db.Column(db.Float, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    transcoded_mtime = db.Column(db.Float, nullable=True) # mtime the variants were made from (None = pending)
+
+# NEW MODEL: Lower-bitrate encodes of a song (written by the transcode stage, see transcode_library)
+class SongVariant(db.Model):
+    __table_args__ = (
+        db.Index('uq_song_variant', 'song_id', 'bitrate', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    song_id = db.Column(db.Integer, db.ForeignKey('song.id'), nullable=False)
+    bitrate = db.Column(db.Integer, nullable=False) # kbps
+    codec = db.Column(db.String(10), nullable=False)
+    path = db.Column(db.String(300), nullable=False) # Relative to TRANSCODE_DIR
+    size = db.Column(db.BigInteger, nullable=False)
+    mtime = db.Column(db.Float, nullable=False)
+
+# NEW MODEL: Lease row for background jobs (one leader across all workers)
+class JobLease(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    progress = db.Column(db.Text, default=None) # JSON
+
+# NEW MODEL: Single-row library version (bumped by every write to the song catalog)
+class LibraryState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# NEW MODEL: Precomputed "For You" data (rebuilt by the recommendations job, see build_recommendations)
+class SongNeighbor(db.Model):
+    song_id = db.Column(db.Integer, primary_key=True)
+    neighbors = db.Column(db.Text, nullable=False) # JSON [[song_id, similarity], ...], best first
+
+class UserRecommendation(db.Model):
+    user_id = db.Column(db.Integer, primary_key=True) # POPULAR_USER_ID holds the global popular list
+    items = db.Column(db.Text, nullable=False) # JSON [[song_id, score], ...], best first
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+# NEW MODEL: Raw player events (bulk-inserted by the event flusher) and per-song daily rollups
+class PlayEvent(db.Model):
+    __table_args__ = (
+        db.Index('ix_play_event_occurred', 'occurred_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=True) # No FKs: events are append-only history
+    song_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(10), nullable=False) # play / skip / seek / complete
+    position = db.Column(db.Float, nullable=True)   # seconds into the track
+    occurred_at = db.Column(db.DateTime, nullable=False)
+
+class SongDailyStats(db.Model):
+    song_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    plays = db.Column(db.Integer, nullable=False, default=0)
+    skips = db.Column(db.Integer, nullable=False, default=0)
+    seeks = db.Column(db.Integer, nullable=False, default=0)
+    completes = db.Column(db.Integer, nullable=False, default=0)
+
+# --- LIBRARY VERSION ---
+def bump_library_version():
+    """Increments the catalog version inside the caller's transaction (caller commits)."""
+    updated = LibraryState.query.filter_by(id=1).update({LibraryState.version: LibraryState.version + 1})
+    if not updated:
+        db.session.add(LibraryState(id=1, version=1))
+
+def current_library_version():
+    return db.session.query(LibraryState.version).filter_by(id=1).scalar() or 0
 
 # --- SCANNER ---
-def scan_library():
-    music_dir = os.path.join(ASSETS_DIR, 'music')
-    if not os.path.exists(music_dir): return
+def _web_path(abs_path):
+    rel = os.path.relpath(abs_path, os.path.join(ASSETS_DIR, '..'))
+    return f"/{rel.replace(os.sep, '/')}"
 
+def _walk_music_dir(music_dir):
+    """
+    Walks the music folder once and returns {web_src: entry} for every mp3.
+    Sidecar covers are resolved from the directory listing (no extra stat calls).
+    """
+    found = {}
     for root, dirs, files in os.walk(music_dir):
         if root == music_dir: continue
-        
-        rel_path = os.path.relpath(root, music_dir)
-        categories = rel_path.split(os.sep)
-        
+
+        categories = [c for c in os.path.relpath(root, music_dir).split(os.sep) if c]
+        names = set(files)
+
         folder_cover = "/assets/default_cover.jpg"
         for file in files:
             if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                rel_path_img = os.path.relpath(os.path.join(root, file), os.path.join(ASSETS_DIR, '..'))
-                folder_cover = f"/{rel_path_img.replace(os.sep, '/')}"
+                folder_cover = _web_path(os.path.join(root, file))
                 break
 
         for file in files:
-            if file.lower().endswith('.mp3'):
-                rel_path_file = os.path.relpath(os.path.join(root, file), os.path.join(ASSETS_DIR, '..'))
-                web_src = f"/{rel_path_file.replace(os.sep, '/')}"
-                
-                base_name = os.path.splitext(file)[0]
-                clean_title = base_name
-                clean_artist = "Unknown Artist"
-
-                if ' - ' in base_name:
-                    parts = base_name.split(' - ', 1)
-                    clean_artist = parts[0].strip()
-                    clean_title = parts[1].strip()
-
-                song = Song.query.filter_by(src=web_src).first()
-                
-                if not song:
-                    web_cover = folder_cover
-                    for ext in ['.jpg', '.jpeg', '.png']:
-                        if os.path.exists(os.path.join(root, base_name + ext)):
-                            rel_c = os.path.relpath(os.path.join(root, base_name + ext), os.path.join(ASSETS_DIR, '..'))
-                            web_cover = f"/{rel_c.replace(os.sep, '/')}"
-                            break
-                    
-                    song = Song(title=clean_title, artist=clean_artist, src=web_src, cover=web_cover)
-                    db.session.add(song)
-                    db.session.commit()
-
-                for category in categories:
-                    if not category: continue
-                    playlist = Playlist.query.filter_by(name=category, is_system=True).first()
-                    if not playlist:
-                        playlist = Playlist(name=category, is_system=True, user_id=None)
-                        db.session.add(playlist)
-                        db.session.commit()
-                    
-                    link = PlaylistSong.query.filter_by(playlist_id=playlist.id, song_id=song.id).first()
-                    if not link:
-                        link = PlaylistSong(playlist_id=playlist.id, song_id=song.id)
-                        db.session.add(link)
-                        db.session.commit()
+            if not file.lower().endswith('.mp3'): continue
+            abs_path = os.path.join(root, file)
+            try:
+                st = os.stat(abs_path)
+            except OSError:
+                continue
+
+            base_name = os.path.splitext(file)[0]
+            clean_title = base_name
+            clean_artist = "Unknown Artist"
+            if ' - ' in base_name:
+                parts = base_name.split(' - ', 1)
+                clean_artist = parts[0].strip()
+                clean_title = parts[1].strip()
+
+            cover = folder_cover
+            for ext in ['.jpg', '.jpeg', '.png']:
+                if base_name + ext in names:
+                    cover = _web_path(os.path.join(root, base_name + ext))
+                    break
+
+            found[_web_path(abs_path)] = {
+                'title': clean_title, 'artist': clean_artist, 'cover': cover,
+                'categories': categories, 'mtime': st.st_mtime, 'size': st.st_size,
+            }
+    return found
+
+def scan_library(full=False):
+    """
+    Incremental library scan.
+    Diffs the filesystem against the LibraryFile manifest and only touches new, changed
+    or removed files. Existing keys are loaded with one query per table and all writes
+    go out in a single transaction. Pass full=True to re-check every file.
+    Returns a dict of counters (also printed).
+    """
+    music_dir = os.path.join(ASSETS_DIR, 'music')
+    if not os.path.exists(music_dir): return None
+
+    t0 = time.perf_counter()
+    found = _walk_music_dir(music_dir)
+    t_walk = time.perf_counter()
+
+    # 1. Load existing keys (one query each)
+    manifest = {f.path: f for f in LibraryFile.query.all()}
+    song_ids = dict(db.session.query(Song.src, Song.id).all())
+    playlist_ids = dict(db.session.query(Playlist.name, Playlist.id).filter_by(is_system=True).all())
+    links = set(db.session.query(PlaylistSong.playlist_id, PlaylistSong.song_id).all())
+    t_load = time.perf_counter()
+
+    # 2. Diff
+    added, changed, stale_variants = [], [], []
+    for src, entry in found.items():
+        known = manifest.get(src)
+        if src not in song_ids:
+            added.append(src)
+        elif full or not known or known.mtime != entry['mtime'] or known.size != entry['size']:
+            changed.append(src)
+    removed = [path for path in manifest if path not in found]
+
+    try:
+        # 3. Removed files: drop the song and everything that points at it
+        if removed:
+            gone_ids = [song_ids[p] for p in removed if p in song_ids]
+            if gone_ids:
+                stale_variants = [path for (path,) in db.session.query(SongVariant.path).filter(SongVariant.song_id.in_(gone_ids))]
+                SongVariant.query.filter(SongVariant.song_id.in_(gone_ids)).delete(synchronize_session=False)
+                PlaylistSong.query.filter(PlaylistSong.song_id.in_(gone_ids)).delete(synchronize_session=False)
+                LikedSong.query.filter(LikedSong.song_id.in_(gone_ids)).delete(synchronize_session=False)
+                Song.query.filter(Song.id.in_(gone_ids)).delete(synchronize_session=False)
+            LibraryFile.query.filter(LibraryFile.path.in_(removed)).delete(synchronize_session=False)
+
+        # 4. New songs (ids come back from a single batched flush)
+        new_songs = [Song(title=found[src]['title'], artist=found[src]['artist'], src=src, cover=found[src]['cover']) for src in added]
+        if new_songs:
+            db.session.add_all(new_songs)
+            db.session.flush()
+            song_ids.update({s.src: s.id for s in new_songs})
+
+        touched = added + changed
+
+        # 5. Missing system playlists
+        new_playlists = {}
+        for src in touched:
+            for category in found[src]['categories']:
+                if category not in playlist_ids and category not in new_playlists:
+                    new_playlists[category] = Playlist(name=category, is_system=True, user_id=None)
+        if new_playlists:
+            db.session.add_all(new_playlists.values())
+            db.session.flush()
+            playlist_ids.update({name: p.id for name, p in new_playlists.items()})
+
+        # 6. Missing playlist links
+        new_links = []
+        for src in touched:
+            sid = song_ids[src]
+            for category in found[src]['categories']:
+                key = (playlist_ids[category], sid)
+                if key not in links:
+                    links.add(key)
+                    new_links.append({'playlist_id': key[0], 'song_id': key[1]})
+        if new_links:
+            db.session.execute(insert(PlaylistSong), new_links)
+
+        # 7. Manifest
+        new_files = []
+        for src in touched:
+            entry = found[src]
+            known = manifest.get(src)
+            if known:
+                known.mtime, known.size = entry['mtime'], entry['size']
+            else:
+                new_files.append({'path': src, 'mtime': entry['mtime'], 'size': entry['size']})
+        if new_files:
+            db.session.execute(insert(LibraryFile), new_files)
+
+        # 8. Changed files: pick up a new sidecar cover, re-run the thumbnail stage (embedded art may differ)
+        if changed:
+            db.session.execute(update(Song), [{'id': song_ids[src], 'cover': found[src]['cover'], 'cover_hash': None} for src in changed])
+
+        if added or removed or changed or new_links:
+            bump_library_version()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    remove_variant_files(stale_variants)
+    t_write = time.perf_counter()
+
+    stats = {
+        'files': len(found), 'added': len(added), 'changed': len(changed), 'removed': len(removed),
+        'playlists_added': len(new_playlists), 'links_added': len(new_links),
+        'walk_ms': round((t_walk - t0) * 1000, 1),
+        'load_ms': round((t_load - t_walk) * 1000, 1),
+        'write_ms': round((t_write - t_load) * 1000, 1),
+        'total_ms': round((t_write - t0) * 1000, 1),
+    }
+    print(f"Scanner: {stats['files']} files ({stats['added']} new, {stats['changed']} changed, {stats['removed']} removed) "
+          f"in {stats['total_ms']}ms [walk {stats['walk_ms']}ms, load {stats['load_ms']}ms, write {stats['write_ms']}ms]")
+    return stats
+
+# --- TRANSCODING ---
+# Offline stage after the scan: every song whose file changed since its last transcode gets
+# lower-bitrate encodes (TRANSCODE_BITRATES, skipping any at or above the source bitrate) plus
+# its duration and integrated loudness, all from one ffmpeg decode pass. TRANSCODE_WORKERS
+# songs are encoded at once, each by its own ffmpeg process. /api/stream picks a variant from
+# the client's hint. Without ffmpeg on the PATH the stage is skipped and originals are streamed.
+TRANSCODE_BITRATES = tuple(sorted(int(b) for b in os.environ.get('TRANSCODE_BITRATES', '64,128').split(',') if b.strip()))
+TRANSCODE_CODEC = os.environ.get('TRANSCODE_CODEC', 'aac') # aac (.m4a, plays everywhere) or opus
+TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS', min(4, os.cpu_count() or 1)))
+TRANSCODE_DIR = os.environ.get('TRANSCODE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'transcoded')
+TRANSCODE_TIMEOUT = 600 # seconds per song
+TRANSCODE_LEASE_TTL = TRANSCODE_TIMEOUT * 2 # Renewed after every song, so it only lapses if the holder dies
+TRANSCODE_BATCH = 50    # songs per background round
+TRANSCODE_JOB = 'transcoder'
+TRANSCODE_CODECS = {
+    'aac': ('aac', '.m4a', ['-movflags', '+faststart']), # moov atom first: playback starts before the download ends
+    'opus': ('libopus', '.opus', []),
+}
+AUDIO_MIMETYPES = {'.mp3': 'audio/mpeg', '.m4a': 'audio/mp4', '.opus': 'audio/ogg'}
+
+def probe_audio(fs_path):
+    """(duration seconds, bitrate kbps) from ffprobe; either may be None."""
+    out = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration,bit_rate', '-of', 'json', fs_path],
+                         capture_output=True, text=True, timeout=60, check=True).stdout
+    fmt = json.loads(out).get('format', {})
+    duration = float(fmt['duration']) if fmt.get('duration') not in (None, 'N/A') else None
+    bitrate = int(fmt['bit_rate']) // 1000 if str(fmt.get('bit_rate', '')).isdigit() else None
+    return duration, bitrate
+
+def transcode_file(fs_path, song_id):
+    """Encodes one file into every useful bitrate and measures it. Returns {duration, loudness, variants}."""
+    duration, source_kbps = probe_audio(fs_path)
+    encoder, ext, extra = TRANSCODE_CODECS[TRANSCODE_CODEC]
+    bitrates = [b for b in TRANSCODE_BITRATES if not source_kbps or b < source_kbps * 0.9]
+
+    cmd = ['ffmpeg', '-hide_banner', '-nostdin', '-y', '-threads', '1', '-i', fs_path]
+    outputs = []
+    for bitrate in bitrates:
+        rel = f"{song_id % 100:02d}/{song_id}-{bitrate}k{ext}" # Spread files over 100 folders
+        tmp = os.path.join(TRANSCODE_DIR, f"{rel}.{os.getpid()}.tmp{ext}") # Per process: a stale leader can't clobber it
+        os.makedirs(os.path.dirname(tmp), exist_ok=True)
+        cmd += ['-map', '0:a:0', '-c:a', encoder, '-b:a', f"{bitrate}k", *extra, tmp]
+        outputs.append((bitrate, rel, tmp))
+    cmd += ['-map', '0:a:0', '-af', 'ebur128=framelog=quiet', '-f', 'null', '-'] # Loudness, same decode pass
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=TRANSCODE_TIMEOUT)
+    if result.returncode != 0:
+        for _, _, tmp in outputs:
+            if os.path.exists(tmp): os.remove(tmp)
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"ffmpeg exit {result.returncode}")
+
+    loudness = re.findall(r'I:\s+(-?[\d.]+) LUFS', result.stderr)
+    variants = []
+    for bitrate, rel, tmp in outputs:
+        final = os.path.join(TRANSCODE_DIR, rel)
+        os.replace(tmp, final)
+        st = os.stat(final)
+        variants.append({'bitrate': bitrate, 'codec': TRANSCODE_CODEC, 'path': rel, 'size': st.st_size, 'mtime': st.st_mtime})
+    return {'duration': duration, 'loudness': float(loudness[-1]) if loudness else None, 'variants': variants}
+
+def ffmpeg_available():
+    return bool(shutil.which('ffmpeg') and shutil.which('ffprobe'))
+
+def remove_variant_files(paths):
+    for rel in paths:
+        fs_path = safe_join(TRANSCODE_DIR, rel)
+        try:
+            if fs_path: os.remove(fs_path)
+        except OSError:
+            pass
+
+def transcode_library(limit=None, lease=None):
+    """
+    Transcodes songs whose file changed since their last transcode. Returns counters (None without ffmpeg).
+    With lease=<job name> the lease is renewed after every song and the batch stops if it was lost.
+    """
+    if not ffmpeg_available():
+        print("Transcode: ffmpeg/ffprobe not found; originals will be streamed.")
+        return None
+    t0 = time.perf_counter()
+    pending = db.session.query(Song.id, Song.src, LibraryFile.mtime) \
+        .join(LibraryFile, LibraryFile.path == Song.src) \
+        .filter(LibraryFile.transcoded_mtime.is_(None) | (LibraryFile.transcoded_mtime != LibraryFile.mtime)) \
+        .order_by(Song.id)
+    pending = (pending.limit(limit) if limit else pending).all()
+    stats = {'songs': 0, 'variants': 0, 'failed': 0}
+
+    with ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix='transcode') as pool:
+        futures = {pool.submit(transcode_file, _asset_fs_path(src), sid): (sid, src, mtime) for sid, src, mtime in pending}
+        for future in as_completed(futures):
+            sid, src, mtime = futures[future]
+            try:
+                result = future.result()
+            except Exception as e: # Broken file or ffmpeg error: stream the original, don't retry until the file changes
+                print(f"Transcode Error ({src}): {e}")
+                result = {'duration': None, 'loudness': None, 'variants': []}
+                stats['failed'] += 1
+            old = [path for (path,) in db.session.query(SongVariant.path).filter_by(song_id=sid)]
+            SongVariant.query.filter_by(song_id=sid).delete(synchronize_session=False)
+            if result['variants']:
+                db.session.execute(insert(SongVariant), [{'song_id': sid, **v} for v in result['variants']])
+            Song.query.filter_by(id=sid).update({Song.duration: result['duration'], Song.loudness: result['loudness']}, synchronize_session=False)
+            LibraryFile.query.filter_by(path=src).update({LibraryFile.transcoded_mtime: mtime}, synchronize_session=False)
+            db.session.commit() # Per song: progress survives a restart
+            remove_variant_files(set(old) - {v['path'] for v in result['variants']})
+            stats['songs'] += 1
+            stats['variants'] += len(result['variants'])
+            if lease and not acquire_lease(lease, TRANSCODE_LEASE_TTL):
+                print("Transcode: lease lost to another worker, stopping this batch")
+                stats['lease_lost'] = True
+                pool.shutdown(wait=True, cancel_futures=True) # Songs not started yet are left to the new leader
+                break
+
+    if pending:
+        bump_library_version() # duration / loudness are part of the catalog
+        db.session.commit()
+    stats['seconds'] = round(time.perf_counter() - t0, 2)
+    print(f"Transcode: {stats['songs']} songs, {stats['variants']} variants, {stats['failed']} failed in {stats['seconds']}s")
+    return stats
+
+def run_transcode_job():
+    """Background loop: the lease holder transcodes pending songs in batches, then idles."""
+    if not ffmpeg_available(): return
+    while True:
+        with app.app_context():
+            try:
+                if acquire_lease(TRANSCODE_JOB, TRANSCODE_LEASE_TTL):
+                    stats = transcode_library(limit=TRANSCODE_BATCH, lease=TRANSCODE_JOB)
+                    if stats['songs'] and not stats.get('lease_lost'):
+                        record_job_progress(TRANSCODE_JOB, stats)
+                        continue
+            except Exception as e:
+                db.session.rollback()
+                print(f"Transcode Job Error: {e}")
+        time.sleep(FIXER_IDLE_SLEEP)
+
+# --- COVER THUMBNAILS ---
+# Offline stage after the scan: each song's art (its sidecar / folder image, else the front
+# picture embedded in the mp3's ID3 tag, else the default cover) is hashed and stored once as
+# square WebP thumbnails (COVER_SIZES) in the blob store, so an album sharing one folder.jpg
+# costs one render. Song.cover_hash points at them and the API returns one URL per size.
+# Files are read and rendered on COVER_WORKERS threads (Pillow releases the GIL while decoding,
+# resizing and encoding). Without Pillow the stage is skipped and clients use the original art.
+COVER_SIZES = tuple(sorted(int(s) for s in os.environ.get('COVER_SIZES', '96,320,640').split(',') if s.strip()))
+COVER_WORKERS = int(os.environ.get('COVER_WORKERS', os.cpu_count() or 1))
+COVER_BATCH = 500 # songs per commit
+DEFAULT_COVER = "/assets/default_cover.jpg"
+
+def cover_key(digest, size):
+    return f"covers/{digest}-{size}.webp"
+
+def cover_urls(digest):
+    """{size: url} for a Song.cover_hash; None while pending or when the song has no art."""
+    return {str(size): media_url(cover_key(digest, size)) for size in COVER_SIZES} if digest else None
+
+def extract_embedded_cover(fs_path):
+    """Picture bytes from an mp3's ID3 tag (the front cover if one is marked), or None."""
+    if ID3 is None or not fs_path: return None
+    try:
+        pictures = ID3(fs_path).getall('APIC') # ID3v2.2 PIC frames come back as APIC too
+    except Exception: # No tag, or not readable
+        return None
+    pictures = [p for p in pictures if p.type == 3] or pictures
+    return pictures[0].data if pictures else None
+
+def _read_asset(web_path):
+    fs_path = _asset_fs_path(web_path)
+    try:
+        with open(fs_path, 'rb') as f:
+            return f.read()
+    except (OSError, TypeError):
+        return None
+
+def load_cover_art(cover, src):
+    """(bytes, sha256, embedded?) of a song's art; src is only set for songs on the default cover."""
+    data, embedded = None, False
+    if src:
+        data = extract_embedded_cover(_asset_fs_path(src))
+        embedded = data is not None
+    if data is None:
+        data = _read_asset(cover)
+    return data, hashlib.sha256(data).hexdigest() if data else '', embedded
+
+def generate_cover_thumbnails(limit=None):
+    """Thumbnails the art of every song without a cover_hash. Returns counters (None without Pillow)."""
+    if Image is None:
+        print("Covers: Pillow not installed; list views use the original art.")
+        return None
+    t0 = time.perf_counter()
+    largest = max(COVER_SIZES)
+    stats = {'songs': 0, 'images': 0, 'rendered': 0, 'failed': 0}
+    stored = set() # Digests whose thumbnails are in the blob store
+
+    with ThreadPoolExecutor(max_workers=COVER_WORKERS, thread_name_prefix='covers') as pool:
+        while not limit or stats['songs'] < limit:
+            batch = COVER_BATCH if not limit else min(COVER_BATCH, limit - stats['songs'])
+            pending = db.session.query(Song.id, Song.src, Song.cover).filter(Song.cover_hash.is_(None)).order_by(Song.id).limit(batch).all()
+            if not pending: break
+            stats['songs'] += len(pending)
+
+            # One read per distinct image file; songs on the default cover each check their own tag
+            sources = defaultdict(list)
+            for sid, src, cover in pending:
+                on_default = not cover or cover == DEFAULT_COVER
+                sources[(cover or DEFAULT_COVER, src if on_default else None)].append(sid)
+            stats['images'] += len(sources)
+
+            loads = {pool.submit(load_cover_art, *source): source for source in sources}
+            renders, waiting, updates = {}, defaultdict(list), []
+
+            def assign(source, digest, embedded):
+                for sid in sources[source]:
+                    row = {'id': sid, 'cover_hash': digest}
+                    if embedded and digest: row['cover'] = media_url(cover_key(digest, largest)) # Full-size views too
+                    updates.append(row)
+
+            for future in as_completed(loads):
+                source = loads[future]
+                try:
+                    data, digest, embedded = future.result()
+                except Exception as e:
+                    print(f"Cover Error ({source[1] or source[0]}): {e}")
+                    data, digest, embedded = None, '', False
+                if not digest or digest in stored:
+                    assign(source, digest, embedded)
+                    continue
+                if digest not in waiting: # First song with this art in the batch
+                    if blob_store.exists(cover_key(digest, largest)):
+                        stored.add(digest)
+                        assign(source, digest, embedded)
+                        continue
+                    renders[pool.submit(render_square_webp, data, COVER_SIZES)] = digest
+                waiting[digest].append((source, embedded))
+
+            for future in as_completed(renders):
+                digest = renders[future]
+                try:
+                    for size, webp in future.result().items():
+                        blob_store.put(cover_key(digest, size), webp, 'image/webp')
+                    stored.add(digest)
+                    stats['rendered'] += 1
+                except Exception as e: # Not an image: keep the original cover, don't retry until the file changes
+                    print(f"Cover Error ({digest[:12]}): {e}")
+                    stats['failed'] += 1
+                for source, embedded in waiting.pop(digest):
+                    assign(source, digest if digest in stored else '', embedded)
+
+            db.session.execute(update(Song), updates)
+            bump_library_version() # covers are part of the catalog
+            db.session.commit() # Per batch: progress survives a restart
+
+    stats['seconds'] = round(time.perf_counter() - t0, 2)
+    if stats['songs']:
+        print(f"Covers: {stats['songs']} songs, {stats['images']} images, {stats['rendered']} rendered, "
+              f"{stats['failed']} failed in {stats['seconds']}s")
+    return stats
+
+# --- INDEX MIGRATIONS ---
+# create_all() only builds indexes for new tables; existing databases get them here.
+# Unique indexes need duplicates removed first (the oldest row wins).
+INDEX_MIGRATIONS = [
+    ('playlist_song', 'uq_playlist_song', ('playlist_id', 'song_id'), True),
+    ('playlist_song', 'ix_playlist_song_song', ('song_id',), False),
+    ('liked_song', 'uq_liked_song', ('user_id', 'song_id'), True),
+    ('playlist', 'ix_playlist_user', ('user_id',), False),
+    ('playlist', 'ix_playlist_system', ('is_system',), False),
+    ('song', 'ix_song_artist', ('artist',), False),
+]
+
+COLUMN_MIGRATIONS = [
+    ('artist_image', 'checked_at', 'TIMESTAMP'),
+    ('song', 'duration', 'FLOAT'),
+    ('song', 'loudness', 'FLOAT'),
+    ('library_file', 'transcoded_mtime', 'FLOAT'),
+    ('song', 'cover_hash', 'VARCHAR(64)'),
+]
+
+def ensure_columns():
+    inspector = sa_inspect(db.engine)
+    for table, column, ddl_type in COLUMN_MIGRATIONS:
+        if column in {c['name'] for c in inspector.get_columns(table)}: continue
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl_type}'))
+            print(f"Migrated: Added {table}.{column}")
+        except Exception as e:
+            print(f"Column Migration Note ({table}.{column}): {e}")
+
+def ensure_indexes():
+    inspector = sa_inspect(db.engine)
+    existing = {table: {ix['name'] for ix in inspector.get_indexes(table)} for table in {m[0] for m in INDEX_MIGRATIONS}}
+    for table, name, columns, unique in INDEX_MIGRATIONS:
+        if name in existing[table]: continue
+        cols = ', '.join(columns)
+        try:
+            with db.engine.begin() as conn:
+                if unique:
+                    removed = conn.execute(text(
+                        f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {cols})"
+                    )).rowcount
+                    if removed: print(f"Migrated: Removed {removed} duplicate rows from {table}")
+                conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({cols})"))
+            print(f"Migrated: Created index {name}")
+        except Exception as e:
+            print(f"Index Migration Note ({name}): {e}")
+
+# --- SEARCH INDEX ---
+# Postgres: pg_trgm GIN index over one lower-cased document expression (maintained by Postgres itself).
+# SQLite: FTS5 table kept in sync with `song` by triggers, so every scanner / fixer write is indexed
+# in the same transaction. Category folders are indexed through the song path.
+PG_SEARCH_DOC = "lower(coalesce(title, '') || ' ' || coalesce(artist, '') || ' ' || src)"
+SQLITE_SEARCH_PATH = "replace(replace({row}.src, '/assets/music/', ''), '/', ' ')"
+SEARCH_LIMIT_MAX = 100
+
+_search_vocab = {'version': None, 'terms': []}
+
+def ensure_search_index():
+    dialect = db.engine.dialect.name
+    try:
+        with db.engine.begin() as conn:
+            if dialect == 'postgresql':
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_song_search_trgm ON song USING gin (({PG_SEARCH_DOC}) gin_trgm_ops)"))
+            elif dialect == 'sqlite':
+                if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'song_fts'")).first():
+                    return
+                conn.execute(text("CREATE VIRTUAL TABLE song_fts USING fts5(title, artist, path, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"))
+                conn.execute(text("CREATE VIRTUAL TABLE song_fts_vocab USING fts5vocab(song_fts, 'row')"))
+                conn.execute(text(f"""
+                    CREATE TRIGGER song_fts_ai AFTER INSERT ON song BEGIN
+                        INSERT INTO song_fts(rowid, title, artist, path) VALUES (new.id, new.title, new.artist, {SQLITE_SEARCH_PATH.format(row='new')});
+                    END"""))
+                conn.execute(text("""
+                    CREATE TRIGGER song_fts_ad AFTER DELETE ON song BEGIN
+                        DELETE FROM song_fts WHERE rowid = old.id;
+                    END"""))
+                conn.execute(text(f"""
+                    CREATE TRIGGER song_fts_au AFTER UPDATE OF title, artist, src ON song BEGIN
+                        UPDATE song_fts SET title = new.title, artist = new.artist, path = {SQLITE_SEARCH_PATH.format(row='new')} WHERE rowid = old.id;
+                    END"""))
+                conn.execute(text(f"INSERT INTO song_fts(rowid, title, artist, path) SELECT id, title, artist, {SQLITE_SEARCH_PATH.format(row='song')} FROM song"))
+                print("Search: Built FTS5 index")
+    except Exception as e:
+        print(f"Search Index Note: {e}")
+
+def _fts_query(tokens, limit, offset):
+    match = ' '.join(f'"{t}"*' for t in tokens) # Prefix match, all tokens required
+    return db.session.execute(text(
+        "SELECT song.id, song.title, song.artist, song.src, song.cover, song.cover_hash, song.duration, song.loudness FROM song_fts "
+        "JOIN song ON song.id = song_fts.rowid WHERE song_fts MATCH :match "
+        "ORDER BY bm25(song_fts), song.id LIMIT :limit OFFSET :offset"
+    ), {'match': match, 'limit': limit, 'offset': offset}).all()
+
+def _correct_tokens(tokens):
+    """Fuzzy step for SQLite: snaps each token to the closest indexed term (vocab cached per library version)."""
+    version = current_library_version()
+    if _search_vocab['version'] != version:
+        terms = [row[0] for row in db.session.execute(text("SELECT term FROM song_fts_vocab")) if not row[0].isdigit()]
+        _search_vocab.update(version=version, terms=terms)
+    corrected = []
+    for token in tokens:
+        close = difflib.get_close_matches(token, _search_vocab['terms'], n=1, cutoff=0.75)
+        corrected.append(close[0] if close else token)
+    return corrected
+
+def search_songs(query, limit=20, offset=0):
+    tokens = re.findall(r'\w+', query.lower())
+    if not tokens: return []
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        q = ' '.join(tokens)
+        rows = db.session.execute(text(
+            f"SELECT id, title, artist, src, cover, cover_hash, duration, loudness FROM song "
+            f"WHERE {PG_SEARCH_DOC} LIKE :like OR :q <% {PG_SEARCH_DOC} "
+            f"ORDER BY word_similarity(:q, {PG_SEARCH_DOC}) DESC, id LIMIT :limit OFFSET :offset"
+        ), {'q': q, 'like': f"%{q}%", 'limit': limit, 'offset': offset}).all()
+    else:
+        try:
+            rows = _fts_query(tokens, limit, offset)
+            if not rows:
+                corrected = _correct_tokens(tokens)
+                if corrected != tokens: rows = _fts_query(corrected, limit, offset)
+        except OperationalError:
+            # FTS5 missing (index not built yet): plain substring scan
+            db.session.rollback()
+            like = f"%{' '.join(tokens)}%"
+            rows = db.session.query(Song.id, Song.title, Song.artist, Song.src, Song.cover,
+                                    Song.cover_hash, Song.duration, Song.loudness).filter(
+                Song.title.ilike(like) | Song.artist.ilike(like) | Song.src.ilike(like)
+            ).order_by(Song.id).limit(limit).offset(offset).all()
+
+    return [song_to_dict(r) for r in rows] # Same shape as /api/songs
+
+# --- JOB LEASES ---
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None) # Naive UTC (portable across SQLite/Postgres)
+
+def _worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}" # Evaluated per call: gunicorn forks after import
+
+def acquire_lease(name, ttl):
+    """
+    Row lease so only one process runs a background job. Takes the lease if it is free or
+    expired, renews it if we already hold it. Returns True when this process is the leader.
+    """
+    now = _utcnow()
+    owner = _worker_id()
+    updated = JobLease.query.filter(
+        JobLease.name == name, (JobLease.expires_at < now) | (JobLease.owner == owner)
+    ).update({JobLease.owner: owner, JobLease.expires_at: now + timedelta(seconds=ttl)}, synchronize_session=False)
+    if updated:
+        db.session.commit()
+        return True
+    try:
+        db.session.add(JobLease(name=name, owner=owner, expires_at=now + timedelta(seconds=ttl)))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback() # Someone else holds it
+        return False
+
+def record_job_progress(name, progress):
+    JobLease.query.filter_by(name=name, owner=_worker_id()).update({JobLease.progress: json.dumps(progress)}, synchronize_session=False)
+    db.session.commit()
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
 
 # --- UPDATED: SAFE METADATA FIXER ---
+FIXER_JOB = 'metadata_fixer'
+FIXER_BATCH_SIZE = int(os.environ.get('FIXER_BATCH_SIZE', 20))     # filenames per prompt
+FIXER_CONCURRENCY = int(os.environ.get('FIXER_CONCURRENCY', 4))    # prompts in flight
+FIXER_RATE = float(os.environ.get('FIXER_RATE', 1.0))              # model calls per second
+FIXER_MAX_RETRIES = int(os.environ.get('FIXER_MAX_RETRIES', 4))
+FIXER_BACKOFF_BASE = 2.0
+FIXER_BACKOFF_MAX = 60.0
+FIXER_LEASE_TTL = 300
+FIXER_IDLE_SLEEP = 60
+FIXER_OUTAGE_SLEEP_MAX = 15 * 60 # Backoff cap for the whole loop while model calls keep failing
+
+fixer_rate_limiter = TokenBucket(FIXER_RATE, max(1, FIXER_CONCURRENCY))
+
+def _messy_song_filter():
+    # Excludes 'Unknown (AI Checked)' to avoid infinite loops on failed files
+    return (Song.artist == "Unknown Artist") | (Song.artist == "Unknown")
+
+def fix_metadata_batch(items):
+    """
+    One model call for many files. `items` is a list of (song_id, filename).
+    Retries with exponential backoff + jitter; returns {song_id: (artist, title)} for the songs the
+    model answered, or None if every attempt failed.
+    """
+    listing = json.dumps([{'id': sid, 'filename': name} for sid, name in items])
+    ai_prompt = f"""
+    Files: {listing}
+    Task: For every file identify 'Artist' and 'Title'.
+    Rules: Use your music knowledge. Remove 'official', 'lyrics', 'mp3'. Use "Unknown" as artist if unsure.
+    Return JSON ONLY: [{{"id": 1, "artist": "Name", "title": "Title"}}]
+    """
+    for attempt in range(FIXER_MAX_RETRIES):
+        fixer_rate_limiter.acquire()
+        try:
+            with track_external('gemini'):
+                response = get_model().generate_content(ai_prompt, request_options={'timeout': GEMINI_TIMEOUT})
+            clean_text = response.text.replace("```json", "").replace("```", "").strip()
+            match = re.search(r'\[.*\]', clean_text, re.DOTALL)
+            data = json.loads(match.group(0)) if match else []
+            return {int(row['id']): (row.get('artist'), row.get('title')) for row in data
+                    if isinstance(row, dict) and str(row.get('id', '')).isdigit()}
+        except Exception as e:
+            delay = min(FIXER_BACKOFF_MAX, FIXER_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+            print(f"   -> Batch failed (attempt {attempt + 1}/{FIXER_MAX_RETRIES}): {e}. Retrying in {delay:.1f}s")
+            time.sleep(delay)
+    return None
+
+def run_metadata_fix_round(pool):
+    """
+    Fixes up to FIXER_BATCH_SIZE * FIXER_CONCURRENCY songs; all results land in one commit.
+    Only songs the model answered for are written (fixed, or marked checked); songs from failed
+    batches stay as they are for a later round. Returns (processed, fixed, failed batches).
+    """
+    messy_songs = db.session.query(Song.id, Song.src, Song.title).filter(_messy_song_filter()) \
+        .order_by(Song.id).limit(FIXER_BATCH_SIZE * FIXER_CONCURRENCY).all()
+    if not messy_songs: return 0, 0, 0
+
+    items = [(s.id, os.path.basename(s.src)) for s in messy_songs]
+    batches = [items[i:i + FIXER_BATCH_SIZE] for i in range(0, len(items), FIXER_BATCH_SIZE)]
+    results, failed = {}, 0
+    for batch_result in pool.map(fix_metadata_batch, batches):
+        if batch_result is None:
+            failed += 1
+        else:
+            results.update(batch_result)
+
+    updates, fixed = [], 0
+    for song in messy_songs:
+        if song.id not in results: continue # No answer for this song: retried later
+        artist, title = results[song.id]
+        if artist and artist != 'Unknown' and title:
+            updates.append({'id': song.id, 'artist': artist[:100], 'title': title[:150]})
+            fixed += 1
+            print(f"   -> Fixed: {title} by {artist}")
+        else:
+            updates.append({'id': song.id, 'artist': "Unknown (AI Checked)", 'title': song.title})
+
+    if updates:
+        db.session.execute(update(Song), updates)
+        bump_library_version()
+        db.session.commit()
+    return len(updates), fixed, failed
+
 def auto_fix_metadata():
     """
-    Continuously checks for songs with bad metadata and fixes them in batches.
-    Runs until no more 'Unknown' songs are found.
+    Background job that fixes songs with bad metadata.
+    Only the holder of the 'metadata_fixer' lease works; other workers just poll the lease.
+    Filenames are sent in batches, batches run concurrently under a shared token bucket,
+    and progress/throughput is written to the lease row (see /api/ai/fixer).
     """
-    if not model: return
+    if not get_model(): return
     
     print("Metadata Fixer: Background thread started.")
-    
-    while True:
-        with app.app_context():
-            # Check for songs with bad metadata
-            # Exclude 'Unknown (AI Checked)' to avoid infinite loops on failed files
-            messy_songs = Song.query.filter(
-                (Song.artist == "Unknown Artist") | (Song.artist == "Unknown")
-            ).limit(10).all() 
-            
-            if not messy_songs:
-                print("Metadata Fixer: All songs processed. Sleeping 60s before next check...")
-                time.sleep(60) # Keep thread alive but sleep long
-                continue
+    started = time.monotonic()
+    totals = {'processed': 0, 'fixed': 0}
+    outage = 0 # Consecutive rounds with failed model calls
 
-            print(f"Metadata Fixer: Processing batch of {len(messy_songs)} songs...")
-
-            for song in messy_songs:
-                filename = os.path.basename(song.src)
-                
-                ai_prompt = f"""
-                Filename: "{filename}"
-                Task: Identify 'Artist' and 'Title'.
-                Rules: Use your music knowledge. Remove 'official', 'lyrics', 'mp3'.
-                Return JSON ONLY: {{"artist": "Name", "title": "Title"}}
-                """
-                
+    with ThreadPoolExecutor(max_workers=FIXER_CONCURRENCY, thread_name_prefix='fixer') as pool:
+        while True:
+            with app.app_context():
                 try:
-                    response = model.generate_content(ai_prompt)
-                    clean_text = response.text.replace("```json", "").replace("```", "").strip()
-                    match = re.search(r'\{.*\}', clean_text, re.DOTALL)
-                    
-                    if match:
-                        data = json.loads(match.group(0))
-                        if data.get('artist') and data['artist'] != 'Unknown':
-                            song.artist = data['artist']
-                            song.title = data['title']
-                            print(f"   -> Fixed: {song.title} by {song.artist}")
-                        else:
-                             song.artist = "Unknown (AI Checked)"
+                    if not acquire_lease(FIXER_JOB, FIXER_LEASE_TTL):
+                        time.sleep(FIXER_IDLE_SLEEP)
+                        continue
+
+                    t0 = time.monotonic()
+                    processed, fixed, failed = run_metadata_fix_round(pool)
+                    totals['processed'] += processed
+                    totals['fixed'] += fixed
+                    elapsed = time.monotonic() - started
+                    progress = {
+                        **totals,
+                        'remaining': Song.query.filter(_messy_song_filter()).count(),
+                        'last_round_s': round(time.monotonic() - t0, 2),
+                        'songs_per_min': round(totals['processed'] / elapsed * 60, 1) if elapsed else 0,
+                        'updated_at': _utcnow().isoformat(),
+                    }
+                    record_job_progress(FIXER_JOB, progress)
+
+                    if failed:
+                        outage += 1
+                        delay = min(FIXER_OUTAGE_SLEEP_MAX, FIXER_IDLE_SLEEP * 2 ** (outage - 1))
+                        print(f"Metadata Fixer: {failed} batches failed ({processed} processed); backing off {delay}s")
+                        time.sleep(delay)
+                        continue
+                    outage = 0
+                    if not processed:
+                        print("Metadata Fixer: All songs processed. Sleeping 60s before next check...")
+                        time.sleep(FIXER_IDLE_SLEEP)
                     else:
-                        song.artist = "Unknown (AI Checked)"
-                    
-                    db.session.commit()
-                    time.sleep(2) # Rate limit
-                    
+                        print(f"Metadata Fixer: {processed} processed ({fixed} fixed) in {progress['last_round_s']}s, "
+                              f"{progress['remaining']} remaining, {progress['songs_per_min']} songs/min")
                 except Exception as e:
-                    print(f"   -> Failed {filename}: {e}")
-                    song.artist = "Unknown (AI Checked)" # Prevent infinite loop
-                    db.session.commit()
-            
-            time.sleep(5) # Pause between batches
+                    db.session.rollback()
+                    print(f"Metadata Fixer Error: {e}")
+                    time.sleep(FIXER_IDLE_SLEEP)
+
+# --- ARTIST IMAGES ---
+# Request paths never wait on Deezer: lookups go LRU -> ArtistImage table, and misses are
+# queued for a background fetch. Failed lookups are remembered for ARTIST_NEGATIVE_TTL.
+# Only artists present in Song.artist are ever fetched or stored, so arbitrary names sent to
+# the public endpoint cost one indexed query and nothing upstream.
+DEEZER_API_URL = os.environ.get('DEEZER_API_URL', 'https://api.deezer.com')
+DEEZER_TIMEOUT = (3, 5) # connect, read (seconds)
+DEFAULT_ARTIST_IMAGE = '/assets/default_cover.jpg'
+ARTIST_NEGATIVE_TTL = int(os.environ.get('ARTIST_NEGATIVE_TTL', 24 * 3600))
+ARTIST_FETCH_CONCURRENCY = int(os.environ.get('ARTIST_FETCH_CONCURRENCY', 4))
+ARTIST_LRU_SIZE = 2048
+ARTIST_NAME_MAX = 100 # Song.artist length
+
+deezer_session = requests.Session()
+deezer_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=ARTIST_FETCH_CONCURRENCY,
+                                             max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503))))
+deezer_session.mount('http://', HTTPAdapter(pool_maxsize=ARTIST_FETCH_CONCURRENCY))
+
+_artist_lru = OrderedDict() # name -> (url or None, expires_at monotonic or None)
+_artist_lock = threading.Lock()
+_artist_pending = set()
+_artist_executor = ThreadPoolExecutor(max_workers=ARTIST_FETCH_CONCURRENCY, thread_name_prefix='artist-image')
+
+def _is_unknown_artist(name):
+    return not name or name.startswith('Unknown')
+
+def _artist_lru_get(name):
+    with _artist_lock:
+        entry = _artist_lru.get(name)
+        if entry is None: return None
+        if entry[1] is not None and entry[1] < time.monotonic():
+            del _artist_lru[name]
+            return None
+        _artist_lru.move_to_end(name)
+        return entry
+
+def _artist_lru_put(name, url):
+    expires = None if url else time.monotonic() + ARTIST_NEGATIVE_TTL
+    with _artist_lock:
+        _artist_lru[name] = (url, expires)
+        _artist_lru.move_to_end(name)
+        while len(_artist_lru) > ARTIST_LRU_SIZE:
+            _artist_lru.popitem(last=False)
+
+def fetch_artist_image_url(artist_name):
+    """Deezer lookup (network only, no DB). Returns the picture URL, '' if none exists, None on error."""
+    try:
+        with track_external('deezer'):
+            response = deezer_session.get(f"{DEEZER_API_URL}/search/artist", params={'q': artist_name, 'limit': 1},
+                                          timeout=DEEZER_TIMEOUT)
+            response.raise_for_status()
+            data = response.json()
+        results = data.get('data') or []
+        if not results: return ''
+        return results[0].get('picture_xl') or results[0].get('picture_medium') or ''
+    except Exception as e:
+        print(f"Deezer API Error ({artist_name}): {e}")
+        return None
+
+def save_artist_images(results):
+    """Upserts {artist_name: url_or_empty} into ArtistImage and the LRU."""
+    if not results: return
+    now = _utcnow()
+    existing = {a.artist_name: a for a in ArtistImage.query.filter(ArtistImage.artist_name.in_(list(results))).all()}
+    for name, url in results.items():
+        row = existing.get(name)
+        if row:
+            row.image_url, row.checked_at = url, now
+        else:
+            db.session.add(ArtistImage(artist_name=name, image_url=url, checked_at=now))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback() # Another worker saved the same artist first
+    for name, url in results.items():
+        _artist_lru_put(name, url)
+
+def _resolve_in_background(artist_name):
+    try:
+        url = fetch_artist_image_url(artist_name)
+        if url is not None:
+            with app.app_context():
+                save_artist_images({artist_name: url})
+    finally:
+        with _artist_lock:
+            _artist_pending.discard(artist_name)
 
-# --- HELPER: FETCH ARTIST IMAGE ---
 def get_artist_image(artist_name):
     """
-    Checks DB for cached image. If missing, fetches from Deezer API and saves it.
+    Returns the cached image URL for an artist without touching the network.
+    On a miss (or an expired negative entry) a background fetch is queued and the default image returned.
+    Names that no song uses get the default image and are never fetched.
     """
-    # 1. Check Cache
-    cached = ArtistImage.query.filter_by(artist_name=artist_name).first()
-    if cached:
-        return cached.image_url
-    
-    # 2. Fetch from Deezer
+    if _is_unknown_artist(artist_name) or len(artist_name) > ARTIST_NAME_MAX: return DEFAULT_ARTIST_IMAGE
+
+    entry = _artist_lru_get(artist_name)
+    if entry is None:
+        row = db.session.query(ArtistImage.image_url, ArtistImage.checked_at).filter_by(artist_name=artist_name).first()
+        if row and (row.image_url or (row.checked_at and row.checked_at > _utcnow() - timedelta(seconds=ARTIST_NEGATIVE_TTL))):
+            _artist_lru_put(artist_name, row.image_url)
+            entry = (row.image_url, None)
+
+    if entry is None:
+        if not db.session.query(Song.id).filter_by(artist=artist_name).first():
+            return DEFAULT_ARTIST_IMAGE
+        with _artist_lock:
+            queued = artist_name in _artist_pending
+            _artist_pending.add(artist_name)
+        if not queued:
+            _artist_executor.submit(_resolve_in_background, artist_name)
+        return DEFAULT_ARTIST_IMAGE
+
+    return entry[0] or DEFAULT_ARTIST_IMAGE
+
+def prefetch_artist_images():
+    """
+    Resolves every distinct Song.artist that has no image (or an expired negative entry),
+    ARTIST_FETCH_CONCURRENCY lookups at a time. Guarded by a job lease so one worker does it.
+    """
+    if not acquire_lease('artist_prefetch', 600): return 0
+    artists = {a for (a,) in db.session.query(Song.artist).distinct() if not _is_unknown_artist(a)}
+    cutoff = _utcnow() - timedelta(seconds=ARTIST_NEGATIVE_TTL)
+    fresh = {name for name, url, checked in db.session.query(ArtistImage.artist_name, ArtistImage.image_url, ArtistImage.checked_at)
+             if url or (checked and checked > cutoff)}
+    todo = sorted(artists - fresh)
+    if not todo: return 0
+
+    t0 = time.perf_counter()
+    results = {}
+    for name, url in zip(todo, _artist_executor.map(fetch_artist_image_url, todo)):
+        if url is not None: results[name] = url
+    save_artist_images(results)
+    print(f"Artist Images: resolved {len(results)}/{len(todo)} artists in {time.perf_counter() - t0:.1f}s")
+    return len(results)
+
+# --- BLOB STORE ---
+# Pluggable storage for uploaded media. Keys are content addressed, so a stored blob never changes.
+#   BLOB_STORE=db     (default) Blob table, survives ephemeral disks on Render
+#   BLOB_STORE=local  files under BLOB_DIR
+#   BLOB_STORE=s3     bucket S3_BUCKET (S3_ENDPOINT_URL for MinIO / local stand-ins), needs boto3
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+PROFILE_PIC_SIZES = (64, 256) # Square avatar variants; the largest one is stored on the User row
+
+class DatabaseBlobStore:
+    def put(self, key, data, content_type):
+        if not db.session.get(Blob, key):
+            db.session.add(Blob(key=key, data=data, content_type=content_type))
+
+    def get(self, key):
+        blob = db.session.get(Blob, key)
+        return (blob.data, blob.content_type) if blob else None
+
+    def exists(self, key):
+        return db.session.query(Blob.key).filter_by(key=key).first() is not None
+
+class LocalBlobStore:
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return safe_join(self.root, key)
+
+    def put(self, key, data, content_type):
+        path = self._path(key)
+        if os.path.exists(path): return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path) # Atomic: readers never see half a file
+
+    def get(self, key):
+        path = self._path(key)
+        if not path or not os.path.exists(path): return None
+        with open(path, 'rb') as f:
+            return f.read(), mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    def exists(self, key):
+        path = self._path(key)
+        return bool(path) and os.path.exists(path)
+
+class S3BlobStore:
+    def __init__(self, bucket, endpoint_url=None):
+        import boto3 # Optional dependency, only needed for BLOB_STORE=s3
+        self.bucket = bucket
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def put(self, key, data, content_type):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type,
+                               CacheControl=MEDIA_CACHE_CONTROL)
+
+    def get(self, key):
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return obj['Body'].read(), obj.get('ContentType', 'application/octet-stream')
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except Exception:
+            return False
+
+def make_blob_store():
+    kind = os.environ.get('BLOB_STORE', 'db')
+    if kind == 'local':
+        return LocalBlobStore(os.environ.get('BLOB_DIR', os.path.join(app.instance_path, 'blobs')))
+    if kind == 's3':
+        return S3BlobStore(os.environ['S3_BUCKET'], os.environ.get('S3_ENDPOINT_URL'))
+    return DatabaseBlobStore()
+
+blob_store = make_blob_store()
+
+def media_url(key):
+    return f"/api/media/{key}"
+
+def store_profile_pic(data, content_type=None):
+    """
+    Stores an uploaded avatar once per content hash, as square WebP variants (PROFILE_PIC_SIZES).
+    Returns the URL of the largest variant. Raises ValueError if the bytes are not an image.
+    Without Pillow the original bytes are stored as-is.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    if Image is None:
+        ext = mimetypes.guess_extension(content_type or '') or '.bin'
+        key = f"avatars/{digest}{ext}"
+        if not blob_store.exists(key):
+            blob_store.put(key, data, content_type or 'application/octet-stream')
+        return media_url(key)
+
+    largest = f"avatars/{digest}-{max(PROFILE_PIC_SIZES)}.webp"
+    if blob_store.exists(largest): return media_url(largest) # Same picture uploaded before
+
+    for size, webp in render_square_webp(data, PROFILE_PIC_SIZES).items():
+        blob_store.put(f"avatars/{digest}-{size}.webp", webp, 'image/webp')
+    return media_url(largest)
+
+def render_square_webp(data, sizes):
+    """Square WebP thumbnails {size: bytes} of an image. Raises ValueError if the bytes are not an image."""
     try:
-        # Search for the artist
-        response = requests.get(f'https://api.deezer.com/search/artist?q={artist_name}')
-        data = response.json()
-        
-        if data and 'data' in data and len(data['data']) > 0:
-            # Get the first result's XL picture
-            image_url = data['data'][0].get('picture_xl') or data['data'][0].get('picture_medium')
-            
-            if image_url:
-                # 3. Save to Cache
-                new_entry = ArtistImage(artist_name=artist_name, image_url=image_url)
-                db.session.add(new_entry)
-                db.session.commit()
-                return image_url
-                
+        img = Image.open(io.BytesIO(data))
+        img.draft('RGB', (max(sizes), max(sizes))) # JPEG: decode at a reduced scale when the source is much bigger
+        img.load()
     except Exception as e:
-        print(f"Deezer API Error: {e}")
-    
-    # 4. Fallback (Use local default if online fetch fails)
-    return '/assets/default_cover.jpg'
+        raise ValueError(f"Not an image: {e}")
+    img = ImageOps.exif_transpose(img).convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+    out = {}
+    for size in sorted(sizes, reverse=True): # Each size is cut from the previous, larger one
+        img = ImageOps.fit(img, (size, size), Image.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, 'WEBP', quality=85, method=4)
+        out[size] = buf.getvalue()
+    return out
+
+def migrate_profile_pics(batch_size=20):
+    """Moves legacy base64 data URIs from User.profile_pic into the blob store. Safe to re-run."""
+    moved, last_id = 0, 0
+    while True:
+        rows = db.session.query(User.id, User.profile_pic).filter(User.id > last_id, User.profile_pic.like('data:%')) \
+            .order_by(User.id).limit(batch_size).all()
+        if not rows: break
+        for user_id, data_uri in rows:
+            last_id = user_id
+            try:
+                header, b64_str = data_uri.split(',', 1)
+                url = store_profile_pic(base64.b64decode(b64_str), header[5:].split(';')[0])
+            except Exception as e:
+                print(f"Profile Pic Migration: user {user_id} skipped ({e})") # Left as-is for the next run
+                continue
+            User.query.filter_by(id=user_id).update({User.profile_pic: url}, synchronize_session=False)
+            moved += 1
+        db.session.commit()
+    if moved: print(f"Profile Pic Migration: moved {moved} pictures to the blob store")
+    return moved
 
 # --- ROUTES ---
 
+# --- REQUEST IDENTITY ---
+# Authenticated routes read the caller through current_user_id() / current_user(), resolved at
+# most once per request (memoized on flask.g). current_user() is a slim summary (no password
+# hash, profile_pic as a URL) from a small in-process TTL cache; profile updates call
+# invalidate_user(). Other web processes may serve the old summary for up to USER_CACHE_TTL seconds.
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))
+USER_CACHE_SIZE = 4096
+
+_user_cache = OrderedDict() # user id -> (summary, expires_at monotonic)
+_user_cache_lock = threading.Lock()
+_user_cache_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+def current_user_id():
+    """The caller's user id as an int (None on optional-JWT routes without a token)."""
+    if 'identity' not in g:
+        identity = get_jwt_identity()
+        g.identity = int(identity) if identity is not None else None
+    return g.identity
+
+def load_user_summary(user_id):
+    row = db.session.query(User.id, User.name, User.email, User.profile_pic).filter_by(id=user_id).first()
+    if not row: return None
+    profile_pic = row.profile_pic
+    if profile_pic and profile_pic.startswith('/assets/users/'): # Legacy file paths are broken on Render
+        profile_pic = None
+    return {'id': row.id, 'name': row.name, 'email': row.email, 'profile_pic': profile_pic}
+
+def get_user_summary(user_id):
+    """Cached {id, name, email, profile_pic} for a user, or None. Callers must not mutate the dict."""
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+        if entry and entry[1] > time.monotonic():
+            _user_cache.move_to_end(user_id)
+            _user_cache_stats['hits'] += 1
+            return entry[0]
+        _user_cache_stats['misses'] += 1
+        generation = _user_cache_stats['invalidations']
+
+    summary = load_user_summary(user_id)
+    with _user_cache_lock:
+        # Skip the store if a profile changed while we were reading (the row may predate it)
+        if summary and generation == _user_cache_stats['invalidations']:
+            _user_cache[user_id] = (summary, time.monotonic() + USER_CACHE_TTL)
+            _user_cache.move_to_end(user_id)
+            while len(_user_cache) > USER_CACHE_SIZE:
+                _user_cache.popitem(last=False)
+    return summary
+
+def invalidate_user(user_id):
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+        _user_cache_stats['invalidations'] += 1
+
+def current_user():
+    """The caller's summary (see get_user_summary), loaded at most once per request."""
+    if 'current_user' not in g:
+        user_id = current_user_id()
+        g.current_user = get_user_summary(user_id) if user_id is not None else None
+    return g.current_user
+
 # --- FRONTEND SERVING ---
+# `flask --app app build-static` (run by build.sh after `npm run build`) writes .br/.gz siblings
+# for compressible files and a manifest of the build (sizes, ETags, variants). Each worker reads
+# the manifest once; requests are answered from it without touching the filesystem metadata:
+# the best encoding the client accepts, ETag/304, immutable caching for Vite's hashed file names,
+# no-cache for index.html. Small files are kept in memory after the first read.
+# Which files are hashed comes from Vite's own build manifest (build.manifest in vite.config.js);
+# files copied from public/ keep their names and are never cached as immutable.
+STATIC_MANIFEST_NAME = 'static-manifest.json'
+STATIC_COMPRESSIBLE = ('.js', '.mjs', '.css', '.html', '.svg', '.json', '.txt', '.ico', '.map', '.webmanifest', '.xml', '.wasm')
+STATIC_ENCODINGS = (('br', '.br'), ('gzip', '.gz')) # Preference order
+STATIC_MIN_COMPRESS = 1024       # bytes; smaller files are not worth a variant
+STATIC_MEMORY_MAX = 512 * 1024   # files up to this size are served from memory
+STATIC_MEMORY_BUDGET = 32 * 1024 * 1024
+VITE_MANIFEST = '.vite/manifest.json'
+HASHED_ASSET = re.compile(r'^assets/[^/]+-[A-Za-z0-9_-]{8}\.(?:js|css)$') # Fallback without a Vite manifest: assets/index-BkT3a9Qz.js
+STATIC_CACHE_CONTROL = "public, max-age=3600"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_static = {'manifest': None, 'bodies': {}, 'body_bytes': 0}
+
+def vite_hashed_files(dist_dir):
+    """Output files Vite fingerprinted (chunks, css, imported assets), or None without a build manifest."""
+    try:
+        with open(os.path.join(dist_dir, VITE_MANIFEST)) as f:
+            chunks = json.load(f).values()
+    except (OSError, ValueError):
+        return None
+    return {path for chunk in chunks for path in [chunk.get('file'), *chunk.get('css', []), *chunk.get('assets', [])] if path}
+
+def scan_dist(dist_dir):
+    """{rel path: {size, etag, immutable, variants: {encoding: size}}} for the build output (music library excluded)."""
+    files = {}
+    hashed = vite_hashed_files(dist_dir)
+    for root, dirs, names in os.walk(dist_dir):
+        rel_root = os.path.relpath(root, dist_dir).replace(os.sep, '/')
+        if rel_root == 'assets':
+            dirs[:] = [d for d in dirs if d != 'music'] # Library media: served by serve_assets / the stream endpoint
+        elif rel_root == '.':
+            dirs[:] = [d for d in dirs if d != '.vite'] # Build metadata, not served
+        present = set(names)
+        for name in names:
+            if name == STATIC_MANIFEST_NAME or any(name.endswith(ext) and name[:-len(ext)] in present for _, ext in STATIC_ENCODINGS):
+                continue
+            rel = name if rel_root == '.' else f"{rel_root}/{name}"
+            st = os.stat(os.path.join(root, name))
+            files[rel] = {
+                'size': st.st_size,
+                'etag': _file_etag(rel, st.st_mtime, st.st_size),
+                'immutable': rel in hashed if hashed is not None else bool(HASHED_ASSET.match(rel)),
+                'variants': {enc: os.path.getsize(os.path.join(root, name + ext))
+                             for enc, ext in STATIC_ENCODINGS if name + ext in present},
+            }
+    return files
+
+def build_static(dist_dir=None):
+    """Precompresses the build output (default DIST_DIR) and writes the manifest. Returns the manifest."""
+    dist_dir = dist_dir or DIST_DIR
+    for rel, entry in scan_dist(dist_dir).items():
+        if not rel.endswith(STATIC_COMPRESSIBLE) or entry['size'] < STATIC_MIN_COMPRESS: continue
+        path = os.path.join(dist_dir, rel)
+        with open(path, 'rb') as f:
+            data = f.read()
+        encoders = {'gzip': lambda d: gzip.compress(d, 9, mtime=0)}
+        if brotli: encoders['br'] = lambda d: brotli.compress(d, quality=11)
+        for enc, ext in STATIC_ENCODINGS:
+            if enc not in encoders: continue
+            packed = encoders[enc](data)
+            if len(packed) < len(data) * 0.9: # Otherwise not worth the Content-Encoding
+                with open(path + ext, 'wb') as f:
+                    f.write(packed)
+            elif os.path.exists(path + ext):
+                os.remove(path + ext)
+    manifest = scan_dist(dist_dir)
+    with open(os.path.join(dist_dir, STATIC_MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+def get_static_manifest():
+    if _static['manifest'] is None:
+        manifest = {}
+        if os.path.isdir(DIST_DIR):
+            try:
+                with open(os.path.join(DIST_DIR, STATIC_MANIFEST_NAME)) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = scan_dist(DIST_DIR) # Built without `flask build-static`: no variants
+        _static['manifest'] = manifest
+    return _static['manifest']
+
+def _static_body(fs_rel, size):
+    body = _static['bodies'].get(fs_rel)
+    if body is not None: return body
+    path = os.path.join(DIST_DIR, fs_rel)
+    if size > STATIC_MEMORY_MAX:
+        return wrap_file(request.environ, open(path, 'rb'))
+    with open(path, 'rb') as f:
+        body = f.read()
+    if _static['body_bytes'] + len(body) <= STATIC_MEMORY_BUDGET:
+        _static['bodies'][fs_rel] = body
+        _static['body_bytes'] += len(body)
+    return body
+
+def send_static(rel, entry):
+    enc = next((e for e, _ in STATIC_ENCODINGS if e in entry['variants'] and request.accept_encodings[e]), None)
+    etag = f"{entry['etag']}-{enc}" if enc else entry['etag']
+    if rel == 'index.html': cache_control = "no-cache"
+    elif entry['immutable']: cache_control = IMMUTABLE_CACHE_CONTROL
+    else: cache_control = STATIC_CACHE_CONTROL
+
+    resp = Response(mimetype=mimetypes.guess_type(rel)[0] or 'application/octet-stream')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = cache_control
+    if entry['variants']: resp.headers['Vary'] = 'Accept-Encoding'
+    if rel == 'index.html': resp.headers['Accept-CH'] = STREAM_HINT_HEADERS # Chromium then sends them with audio requests
+    if request.if_none_match.contains(etag):
+        resp.status_code = 304
+        return resp
+
+    size = entry['variants'][enc] if enc else entry['size']
+    if enc: resp.headers['Content-Encoding'] = enc
+    resp.content_length = size
+    if request.method != 'HEAD':
+        body = _static_body(rel + dict(STATIC_ENCODINGS).get(enc, ''), size)
+        resp.response = [body] if isinstance(body, bytes) else body
+        resp.direct_passthrough = True
+    return resp
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve_frontend(path):
-    # DIST_DIR is defined in Configuration section
-    if not os.path.exists(DIST_DIR):
+    manifest = get_static_manifest()
+    if not manifest:
         return "Rhymic Backend Running (Frontend not built)", 200
 
-    if path != "" and os.path.exists(os.path.join(DIST_DIR, path)):
-        return send_from_directory(DIST_DIR, path)
-    
-    # Handle SPA routing (return index.html)
-    if os.path.exists(os.path.join(DIST_DIR, 'index.html')):
-        return send_from_directory(DIST_DIR, 'index.html')
+    entry = manifest.get(path)
+    if entry is None: # Handle SPA routing (return index.html)
+        path, entry = 'index.html', manifest.get('index.html')
+    if entry is None:
+        return "Rhymic Frontend Error", 404
+    return send_static(path, entry)
+
+# --- AUDIO STREAMING ---
+AUDIO_CACHE_CONTROL = "public, max-age=3600"
+IMAGE_CACHE_CONTROL = "public, max-age=86400" # Library art can be replaced in place; ETag / Last-Modified revalidate it
+
+def _asset_fs_path(web_src):
+    """Maps a '/assets/...' web path to a file inside ASSETS_DIR (None if it escapes the folder)."""
+    if not web_src or not web_src.startswith('/assets/'): return None
+    return safe_join(ASSETS_DIR, web_src[len('/assets/'):])
+
+def _file_etag(path, mtime, size):
+    return hashlib.sha1(f"{path}:{mtime}:{size}".encode('utf-8')).hexdigest()[:24]
+
+def _iter_file_range(f, start, length, chunk_size=64 * 1024):
+    try:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk: break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+def send_audio(web_src, fs_path, mtime=None, size=None):
+    """
+    Range-aware audio response.
+    Uses the scanner's manifest (mtime/size) for a strong ETag + Last-Modified, answers
+    If-None-Match / If-Modified-Since with 304, single byte ranges with 206 (If-Range aware)
+    and unsatisfiable ranges with 416. Under gunicorn the body is handed to wsgi.file_wrapper
+    (os.sendfile) from the range offset, so no bytes are copied through Python.
+    """
+    if mtime is None or size is None:
+        try:
+            st = os.stat(fs_path)
+        except OSError:
+            return "Not Found", 404
+        mtime, size = st.st_mtime, st.st_size
+
+    etag = _file_etag(web_src, mtime, size)
+    last_modified = datetime.fromtimestamp(int(mtime), tz=timezone.utc)
+
+    resp = Response(mimetype=AUDIO_MIMETYPES.get(os.path.splitext(web_src)[1].lower(), 'audio/mpeg'), direct_passthrough=True)
+    resp.set_etag(etag)
+    resp.last_modified = last_modified
+    resp.headers['Cache-Control'] = AUDIO_CACHE_CONTROL
+    resp.headers['Accept-Ranges'] = 'bytes'
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        resp.status_code = 304
+        return resp
+
+    # If-Range: only honor the Range header when the validator still matches
+    start, length = 0, size
+    rng = request.range
+    if_range = request.if_range
+    if if_range.etag and if_range.etag != etag: rng = None
+    if if_range.date and if_range.date < last_modified: rng = None
+
+    if rng:
+        bounds = rng.range_for_length(size) if len(rng.ranges) == 1 else None
+        if bounds is None:
+            resp.status_code = 416
+            resp.headers['Content-Range'] = f"bytes */{size}"
+            return resp
+        start, stop = bounds
+        length = stop - start
+        resp.status_code = 206
+        resp.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+
+    try:
+        f = open(fs_path, 'rb')
+    except OSError:
+        return "Not Found", 404
+
+    resp.content_length = length
+    if request.method == 'HEAD':
+        f.close()
+        return resp
+
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper and 'gunicorn' in request.environ.get('SERVER_SOFTWARE', ''):
+        # gunicorn sendfile()s from the current offset and stops at Content-Length
+        f.seek(start)
+        resp.response = file_wrapper(f, 64 * 1024)
+    else:
+        resp.response = _iter_file_range(f, start, length)
+    return resp
+
+STREAM_QUALITY_KBPS = {'low': 64, 'medium': 128, 'high': 256}
+ECT_KBPS = {'slow-2g': 48, '2g': 64, '3g': 128} # Effective connection type client hint; 4g gets the original
+STREAM_HINT_HEADERS = 'Save-Data, ECT, Downlink'
+
+def stream_budget_kbps():
+    """
+    Bitrate ceiling from the client's hint, or None for the original file. In order:
+    ?quality=low|medium|high|original, ?max_kbps=N, then the Save-Data / ECT / Downlink headers.
+    """
+    quality = request.args.get('quality')
+    if quality == 'original': return None
+    if quality in STREAM_QUALITY_KBPS: return STREAM_QUALITY_KBPS[quality]
+    max_kbps = request.args.get('max_kbps', type=int)
+    if max_kbps: return max_kbps
+    if request.headers.get('Save-Data', '').lower() == 'on': return 0 # Smallest variant
+    if request.headers.get('ECT') in ECT_KBPS: return ECT_KBPS[request.headers['ECT']]
+    downlink = request.headers.get('Downlink', type=float) # Mbps
+    if downlink: return int(downlink * 1000 / 4) # Leave headroom for buffering ahead
+    return None
+
+@app.route('/api/stream/<int:song_id>', methods=['GET', 'HEAD'])
+def stream_song(song_id):
+    """Audio for a song; picks a transcoded variant when the client hints at a slow or metered link."""
+    row = db.session.query(Song.src, Song.duration, LibraryFile.mtime, LibraryFile.size, LibraryFile.transcoded_mtime) \
+        .outerjoin(LibraryFile, LibraryFile.path == Song.src) \
+        .filter(Song.id == song_id).first()
+    if not row: return jsonify({"message": "Not found"}), 404
+    fs_path = _asset_fs_path(row.src)
+    if not fs_path: return jsonify({"message": "Not found"}), 404
+
+    budget = stream_budget_kbps()
+    source_kbps = row.size * 8 / row.duration / 1000 if row.size and row.duration else None
+    if budget is not None and (source_kbps is None or budget < source_kbps) and row.transcoded_mtime == row.mtime:
+        variants = db.session.query(SongVariant.bitrate, SongVariant.path, SongVariant.mtime, SongVariant.size) \
+            .filter_by(song_id=song_id).order_by(SongVariant.bitrate).all()
+        fitting = [v for v in variants if v.bitrate <= budget] or variants[:1]
+        if fitting:
+            variant = fitting[-1]
+            variant_path = safe_join(TRANSCODE_DIR, variant.path)
+            if variant_path and os.path.isfile(variant_path):
+                resp = send_audio(f"/transcoded/{variant.path}", variant_path, variant.mtime, variant.size)
+                if isinstance(resp, Response): resp.headers['Vary'] = STREAM_HINT_HEADERS
+                return resp
+            # Variant missing on this disk (fresh deploy, wiped instance/): stream the original and
+            # mark the song pending so the transcoder rebuilds it
+            print(f"Stream: variant {variant.path} missing, queueing song {song_id} for transcoding")
+            LibraryFile.query.filter_by(path=row.src, transcoded_mtime=row.transcoded_mtime) \
+                .update({LibraryFile.transcoded_mtime: None}, synchronize_session=False)
+            db.session.commit()
 
-    return "Rhymic Frontend Error", 404
+    resp = send_audio(row.src, fs_path, row.mtime, row.size)
+    if isinstance(resp, Response): resp.headers['Vary'] = STREAM_HINT_HEADERS
+    return resp
 
 @app.route('/assets/<path:filename>')
 def serve_assets(filename):
-    try: return send_from_directory(ASSETS_DIR, unquote(filename))
-    except: 
-        if filename.endswith(('.jpg', '.png')): return send_from_directory(ASSETS_DIR, 'default_cover.jpg')
-        return "Not Found", 404
+    if filename.lower().endswith('.mp3'):
+        web_src = f"/assets/{filename}"
+        fs_path = _asset_fs_path(web_src)
+        if not fs_path: return "Not Found", 404
+        known = LibraryFile.query.filter_by(path=web_src).first()
+        return send_audio(web_src, fs_path, known.mtime if known else None, known.size if known else None)
+
+    entry = get_static_manifest().get(f"assets/{filename}") # Build output (hashed JS/CSS, fonts, icons)
+    if entry is not None:
+        return send_static(f"assets/{filename}", entry)
+
+    try:
+        resp = send_from_directory(ASSETS_DIR, filename)
+    except NotFound:
+        if not filename.endswith(('.jpg', '.png')): return "Not Found", 404
+        resp = send_from_directory(ASSETS_DIR, 'default_cover.jpg')
+        resp.headers['Cache-Control'] = STATIC_CACHE_CONTROL # Placeholder: the real art may show up later
+        return resp
+    if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
+        resp.headers['Cache-Control'] = IMAGE_CACHE_CONTROL
+    return resp
+
+# --- CANDIDATE RETRIEVAL (Smart DJ) ---
+# Keeps the Gemini prompt bounded: a TF-IDF inverted index over title / artist / category
+# folder picks a cosine top-k shortlist, and only that shortlist is sent to the model.
+RECOMMEND_CANDIDATES = int(os.environ.get('RECOMMEND_CANDIDATES', 60))
+CATEGORY_WEIGHT = 2.0 # Language / genre folders matter more than title words
+
+_retrieval_lock = threading.Lock()
+_retrieval_index = {'version': None}
+
+def _tokenize(value):
+    return re.findall(r'\w+', (value or '').lower())
+
+def _song_terms(song):
+    terms = Counter(_tokenize(song['title']) + _tokenize(song['artist']))
+    folders = song['src'].split('/')[3:-1] # /assets/music/<categories...>/<file>
+    for folder in folders:
+        for token in _tokenize(folder):
+            terms[token] += CATEGORY_WEIGHT
+    return terms
+
+def get_retrieval_index(version):
+    with _retrieval_lock:
+        if _retrieval_index['version'] == version:
+            return _retrieval_index
+
+        songs = get_song_catalog(version)['songs']
+        doc_terms = {s['id']: _song_terms(s) for s in songs}
+        df = Counter(term for terms in doc_terms.values() for term in terms)
+        n = len(songs)
+        idf = {term: math.log((n + 1) / (count + 1)) + 1 for term, count in df.items()}
+
+        postings = defaultdict(list)
+        norms = {}
+        for sid, terms in doc_terms.items():
+            norm = 0.0
+            for term, tf in terms.items():
+                w = tf * idf[term]
+                postings[term].append((sid, w))
+                norm += w * w
+            norms[sid] = math.sqrt(norm) or 1.0
+
+        _retrieval_index.clear()
+        _retrieval_index.update(version=version, idf=idf, postings=postings, norms=norms,
+                                songs={s['id']: s for s in songs}, ids=[s['id'] for s in songs])
+        return _retrieval_index
+
+def retrieve_candidates(prompt, k=None):
+    """
+    Returns up to k song dicts for the prompt: cosine top-k over the metadata index, padded
+    with a random sample when the prompt is a 'vibe' that matches little metadata.
+    """
+    k = k or RECOMMEND_CANDIDATES
+    index = get_retrieval_index(current_library_version())
+    query = Counter(_tokenize(prompt))
+
+    scores = defaultdict(float)
+    for term, qtf in query.items():
+        qw = qtf * index['idf'].get(term, 0.0)
+        if not qw: continue
+        for sid, w in index['postings'][term]:
+            scores[sid] += qw * w
+
+    ranked = heapq.nlargest(k, scores, key=lambda sid: scores[sid] / index['norms'][sid])
+    if len(ranked) < k:
+        chosen = set(ranked)
+        pool = index['ids']
+        extra = random.sample(pool, min(len(pool), k + len(chosen)))
+        ranked += [sid for sid in extra if sid not in chosen][:k - len(ranked)]
+    return [index['songs'][sid] for sid in ranked]
+
+def hydrate_songs(ids):
+    """One IN query; output follows the order of `ids` and drops unknown ids."""
+    if not ids: return []
+    by_id = {s.id: s for s in Song.query.filter(Song.id.in_(ids)).all()}
+    return [song_to_dict(by_id[sid]) for sid in ids if sid in by_id]
+
+# --- SMART DJ RESPONSE CACHE ---
+AI_CACHE_TTL = int(os.environ.get('AI_CACHE_TTL', 600))       # seconds
+AI_CACHE_SIZE = int(os.environ.get('AI_CACHE_SIZE', 256))      # prompts kept per worker
+AI_COALESCE_WAIT = GEMINI_TIMEOUT + 5                          # max seconds a duplicate request waits on the leader
+
+class RecommendationCache:
+    """
+    Normalized prompt -> song ids, with TTL + LRU eviction, scoped to one library version.
+    Concurrent misses for the same prompt are coalesced: one caller runs the model,
+    the others wait for its result (single-flight).
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (expires_at, ids)
+        self._inflight = {}           # key -> {'event', 'result'}
+        self._version = None
+        self.hits = self.misses = self.coalesced = self.evictions = 0
+
+    def get_or_compute(self, key, version, compute):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = {'event': threading.Event(), 'result': None}
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight['event'].wait(AI_COALESCE_WAIT)
+            return flight['result']
+
+        result = None
+        try:
+            result = compute()
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if result is not None and version == self._version: # None = failed call, don't cache
+                    self._entries[key] = (time.monotonic() + self.ttl, result)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+            flight['result'] = result
+            flight['event'].set()
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                    'evictions': self.evictions, 'size': len(self._entries), 'inflight': len(self._inflight),
+                    'library_version': self._version}
+
+recommend_cache = RecommendationCache(AI_CACHE_SIZE, AI_CACHE_TTL)
+
+def normalize_prompt(prompt):
+    return ' '.join(_tokenize(prompt))
 
 # --- AI ROUTE ---
 @app.route('/api/ai/recommend', methods=['POST'])
@@ -284,25 +1938,67 @@ def serve_assets(filename):
 def recommend_songs():
     # Fallback: Random songs
     def get_fallback():
-        all_s = Song.query.all()
-        return random.sample(all_s, min(len(all_s), 10)) if all_s else []
+        return sample_songs(10)
     
-    if not model: return jsonify([{'id': s.id, 'title': s.title, 'artist': s.artist, 'src': s.src, 'cover': s.cover} for s in get_fallback()])
+    if not get_model(): return jsonify(get_fallback())
 
-    data = request.get_json()
-    user_prompt = data.get('prompt')
+    data = request.get_json() or {}
+    user_prompt = data.get('prompt') or ''
     
-    all_songs = Song.query.all()
+    ids = recommend_cache.get_or_compute(normalize_prompt(user_prompt), current_library_version(),
+                                         lambda: ask_model_for_ids(user_prompt))
+    result_songs = hydrate_songs(ids or [])
+    if not result_songs: return jsonify(get_fallback())
+    return jsonify(result_songs)
+
+@app.route('/api/ai/stats', methods=['GET'])
+def ai_cache_stats():
+    return jsonify(recommend_cache.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    lines = []
+    for histogram in METRIC_HISTOGRAMS:
+        lines.extend(histogram.render())
+    cache = recommend_cache.stats()
+    for key in ('hits', 'misses', 'coalesced', 'evictions'):
+        lines.append(f"# TYPE rhymic_ai_cache_{key}_total counter")
+        lines.append(f"rhymic_ai_cache_{key}_total {cache[key]}")
+    events = event_buffer.stats()
+    for key in ('accepted', 'dropped', 'flushed', 'failed'):
+        lines.append(f"# TYPE rhymic_events_{key}_total counter")
+        lines.append(f"rhymic_events_{key}_total {events[key]}")
+    for key in ('hits', 'misses', 'invalidations'):
+        lines.append(f"# TYPE rhymic_user_cache_{key}_total counter")
+        lines.append(f"rhymic_user_cache_{key}_total {_user_cache_stats[key]}")
+    lines.append("# TYPE rhymic_events_buffered gauge")
+    lines.append(f"rhymic_events_buffered {events['buffered']}")
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/ai/fixer', methods=['GET'])
+def fixer_status():
+    lease = JobLease.query.get(FIXER_JOB)
+    if not lease: return jsonify({"running": False})
+    return jsonify({
+        "running": lease.expires_at > _utcnow(),
+        "owner": lease.owner,
+        "lease_expires_at": lease.expires_at.isoformat(),
+        "progress": json.loads(lease.progress) if lease.progress else None,
+    })
+
+def ask_model_for_ids(user_prompt):
+    """Runs retrieval + one model call. Returns the chosen song ids, or None if the call failed."""
+    candidates = retrieve_candidates(user_prompt)
     
     # Context: Include 'path' so AI sees the folder structure (e.g., "assets/music/Hindi/Song.mp3")
     library_context = [
         {
-            'id': s.id, 
-            'title': s.title, 
-            'artist': s.artist, 
-            'path': s.src 
+            'id': s['id'], 
+            'title': s['title'], 
+            'artist': s['artist'], 
+            'path': s['src'] 
         } 
-        for s in all_songs
+        for s in candidates
     ]
 
     # --- STRICTER PROMPT ---
@@ -327,101 +2023,678 @@ def recommend_songs():
     """
 
     try:
-        response = model.generate_content(ai_prompt)
+        with track_external('gemini'):
+            response = get_model().generate_content(ai_prompt, request_options={'timeout': GEMINI_TIMEOUT})
         match = re.search(r'\[.*\]', response.text.replace("```json", ""), re.DOTALL)
         ids = json.loads(match.group(0)) if match else []
         
-        # Fetch songs preserving AI order
-        result_songs = []
-        for sid in ids:
-            song = Song.query.get(sid)
-            if song:
-                result_songs.append({
-                    'id': song.id, 
-                    'title': song.title, 
-                    'artist': song.artist, 
-                    'src': song.src, 
-                    'cover': song.cover
-                })
-        
-        if not result_songs: return jsonify([{'id': s.id, 'title': s.title, 'artist': s.artist, 'src': s.src, 'cover': s.cover} for s in get_fallback()])
-
-        return jsonify(result_songs)
+        # Only accept ids from the shortlist, keep AI order, drop duplicates
+        allowed = {s['id'] for s in candidates}
+        return list(dict.fromkeys(int(sid) for sid in ids if str(sid).isdigit() and int(sid) in allowed))
     except Exception as e:
         print(f"AI Error: {e}")
-        return jsonify([{'id': s.id, 'title': s.title, 'artist': s.artist, 'src': s.src, 'cover': s.cover} for s in get_fallback()])
+        return None
+
+# --- FOR YOU ---
+# Item-based collaborative filtering, no model calls. Every user's likes and each of their
+# playlists is a "basket"; two songs are similar when they share baskets (co-occurrence count,
+# cosine-normalized by popularity and shrunk towards 0 for rare pairs). A periodic job keeps the
+# RECS_NEIGHBORS nearest songs per song and the top RECS_TOP_N unseen songs per user in small
+# tables, so serving is a primary-key lookup. New likes fold their song's neighbors into the
+# user's row right away; the next rebuild recomputes everything.
+RECS_TOP_N = int(os.environ.get('RECS_TOP_N', 50))
+RECS_NEIGHBORS = int(os.environ.get('RECS_NEIGHBORS', 50))
+RECS_INTERVAL = int(os.environ.get('RECS_INTERVAL', 6 * 3600)) # seconds between rebuilds
+RECS_MAX_BASKET = 500 # Most recent songs per basket; bounds the pairwise cost of huge playlists
+RECS_SHRINK = 2.0
+RECS_JOB = 'recommendations'
+POPULAR_USER_ID = 0 # No real user has id 0
+
+def _load_baskets():
+    """Returns (basket owner user ids, basket index per entry, song id per entry), newest entries first."""
+    likes = db.session.query(LikedSong.user_id, LikedSong.user_id, LikedSong.song_id).order_by(LikedSong.id.desc())
+    playlists = db.session.query(-Playlist.id, Playlist.user_id, PlaylistSong.song_id) \
+        .join(PlaylistSong, PlaylistSong.playlist_id == Playlist.id) \
+        .filter(Playlist.is_system == False, Playlist.user_id.isnot(None)).order_by(PlaylistSong.id.desc())
+
+    basket_index, owners, baskets, songs, sizes = {}, [], [], [], Counter()
+    for key, user_id, song_id in list(likes) + list(playlists): # Likes keyed by user id, playlists by -playlist id
+        b = basket_index.get(key)
+        if b is None:
+            b = basket_index[key] = len(owners)
+            owners.append(user_id)
+        if sizes[b] >= RECS_MAX_BASKET: continue
+        sizes[b] += 1
+        baskets.append(b)
+        songs.append(song_id)
+    return owners, baskets, songs
+
+def compute_recommendations():
+    """
+    Builds the For You data from likes and user playlists.
+    Returns ({song_id: [(id, sim), ...]}, {user_id: [(id, score), ...]}, [(id, popularity), ...]).
+    """
+    import numpy as np # Only the job needs NumPy; keeps it out of web worker boot
+
+    owners, baskets, songs = _load_baskets()
+    if not songs: return {}, {}, []
+    owners = np.array(owners)
+    basket_of = np.array(baskets)
+    song_ids, item_of = np.unique(np.array(songs), return_inverse=True)
+    popularity = np.bincount(item_of, minlength=len(song_ids))
+
+    # CSR views: items per basket and baskets per item
+    by_basket = np.argsort(basket_of, kind='stable')
+    basket_items = item_of[by_basket]
+    basket_ptr = np.searchsorted(basket_of[by_basket], np.arange(len(owners) + 1))
+    by_item = np.argsort(item_of, kind='stable')
+    item_baskets = basket_of[by_item]
+    item_ptr = np.searchsorted(item_of[by_item], np.arange(len(song_ids) + 1))
+
+    def gather(ptr, values, rows):
+        """Concatenation of values[ptr[r]:ptr[r + 1]] for every r in rows."""
+        starts, lengths = ptr[rows], ptr[rows + 1] - ptr[rows]
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return values[offsets + np.arange(lengths.sum())]
+
+    neighbor_items, neighbor_sims = [], []
+    for i in range(len(song_ids)):
+        co = gather(basket_ptr, basket_items, item_baskets[item_ptr[i]:item_ptr[i + 1]])
+        items, counts = np.unique(co[co != i], return_counts=True)
+        sims = counts / (np.sqrt(popularity[i] * popularity[items]) + RECS_SHRINK)
+        if len(items) > RECS_NEIGHBORS:
+            keep = np.argpartition(-sims, RECS_NEIGHBORS)[:RECS_NEIGHBORS]
+            items, sims = items[keep], sims[keep]
+        order = np.argsort(-sims)
+        neighbor_items.append(items[order])
+        neighbor_sims.append(sims[order])
+
+    per_user = {}
+    entry_owner = owners[basket_of]
+    by_owner = np.argsort(entry_owner, kind='stable')
+    user_ids, owner_start = np.unique(entry_owner[by_owner], return_index=True)
+    owner_ptr = np.append(owner_start, len(by_owner))
+    for u, user_id in enumerate(user_ids):
+        owned = np.unique(item_of[by_owner[owner_ptr[u]:owner_ptr[u + 1]]])
+        candidates = np.concatenate([neighbor_items[i] for i in owned])
+        if not len(candidates): continue
+        weights = np.concatenate([neighbor_sims[i] for i in owned])
+        items, inverse = np.unique(candidates, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        unseen = ~np.isin(items, owned)
+        items, scores = items[unseen], scores[unseen]
+        order = np.argsort(-scores)[:RECS_TOP_N]
+        per_user[int(user_id)] = [(int(song_ids[items[k]]), round(float(scores[k]), 4)) for k in order]
+
+    neighbors = {int(song_ids[i]): [(int(song_ids[j]), round(float(sim), 4)) for j, sim in zip(neighbor_items[i], neighbor_sims[i])]
+                 for i in range(len(song_ids)) if len(neighbor_items[i])}
+    top = np.argsort(-popularity, kind='stable')[:RECS_TOP_N]
+    popular = [(int(song_ids[i]), int(popularity[i])) for i in top]
+    return neighbors, per_user, popular
+
+def build_recommendations():
+    """Recomputes and replaces the For You tables in one transaction. Returns stats."""
+    t0 = time.monotonic()
+    neighbors, per_user, popular = compute_recommendations()
+    now = _utcnow()
+    SongNeighbor.query.delete(synchronize_session=False)
+    UserRecommendation.query.delete(synchronize_session=False)
+    if neighbors:
+        db.session.execute(insert(SongNeighbor), [{'song_id': sid, 'neighbors': json.dumps(items)} for sid, items in neighbors.items()])
+    rows = [{'user_id': uid, 'items': json.dumps(items), 'updated_at': now} for uid, items in per_user.items()]
+    rows.append({'user_id': POPULAR_USER_ID, 'items': json.dumps(popular), 'updated_at': now})
+    db.session.execute(insert(UserRecommendation), rows)
+    db.session.commit()
+    return {'songs': len(neighbors), 'users': len(per_user), 'seconds': round(time.monotonic() - t0, 2), 'built_at': now.isoformat()}
+
+def update_recommendations_for_likes(user_id, song_ids):
+    """Folds the neighbors of newly liked songs into the user's stored list (caller commits)."""
+    rows = db.session.query(SongNeighbor.neighbors).filter(SongNeighbor.song_id.in_(song_ids)).all() if song_ids else []
+    if not rows: return
+    current = db.session.query(UserRecommendation.items).filter_by(user_id=user_id).scalar()
+    scores = defaultdict(float, {sid: score for sid, score in json.loads(current or '[]')})
+    for (neighbors,) in rows:
+        for sid, sim in json.loads(neighbors):
+            scores[sid] += sim
+    liked = {sid for (sid,) in db.session.query(LikedSong.song_id).filter_by(user_id=user_id)}
+    top = heapq.nlargest(RECS_TOP_N, ((sid, score) for sid, score in scores.items() if sid not in liked), key=lambda x: x[1])
+    values = {'items': json.dumps([[sid, round(score, 4)] for sid, score in top]), 'updated_at': _utcnow()}
+    db.session.execute(_dialect_insert(UserRecommendation).values(user_id=user_id, **values)
+                       .on_conflict_do_update(index_elements=['user_id'], set_=values))
+
+def sample_songs(k, exclude=()):
+    """Up to k random songs without loading the table: random ids in [min(id), max(id)], fetched by primary key."""
+    lo, hi = db.session.query(func.min(Song.id), func.max(Song.id)).one()
+    if lo is None: return []
+    picked = {}
+    for _ in range(3): # Ids can have gaps (removed songs); retry a few times
+        want = k - len(picked)
+        if want <= 0: break
+        ids = set(random.sample(range(lo, hi + 1), min(hi - lo + 1, want * 2))) - set(exclude) - picked.keys()
+        for song in Song.query.filter(Song.id.in_(ids)).limit(want):
+            picked[song.id] = song
+    return [song_to_dict(s) for s in picked.values()]
+
+def run_recommendations_job():
+    """Background loop: the lease holder rebuilds the For You tables every RECS_INTERVAL seconds."""
+    while True:
+        with app.app_context():
+            try:
+                if acquire_lease(RECS_JOB, RECS_INTERVAL + 600):
+                    stats = build_recommendations()
+                    record_job_progress(RECS_JOB, stats)
+                    print(f"Recommendations: {stats['users']} users, {stats['songs']} songs in {stats['seconds']}s")
+            except Exception as e:
+                db.session.rollback()
+                print(f"Recommendations Error: {e}")
+        time.sleep(RECS_INTERVAL)
+
+@app.route('/api/recommendations', methods=['GET'])
+@jwt_required()
+def for_you():
+    """Precomputed For You list (?limit=N, default 12): the user's own row, then popular songs, then a random sample."""
+    user_id = current_user_id()
+    limit = max(1, min(request.args.get('limit', 12, type=int), RECS_TOP_N))
+    rows = dict(db.session.query(UserRecommendation.user_id, UserRecommendation.items)
+                .filter(UserRecommendation.user_id.in_([user_id, POPULAR_USER_ID])))
+    ids = [sid for sid, _ in json.loads(rows.get(user_id, '[]'))]
+    if len(ids) < limit:
+        ids += [sid for sid, _ in json.loads(rows.get(POPULAR_USER_ID, '[]')) if sid not in ids]
+    songs = hydrate_songs(ids[:limit])
+    if len(songs) < limit:
+        songs += sample_songs(limit - len(songs), exclude=[s['id'] for s in songs])
+    return jsonify(songs)
+
+# --- PLAY EVENTS ---
+# The player posts batches of play/skip/seek/complete events. The endpoint only validates and
+# appends to an in-process buffer (no DB work on the request path); a daemon thread per worker
+# drains the buffer every EVENTS_FLUSH_INTERVAL seconds (sooner once EVENTS_FLUSH_SIZE are
+# waiting) with one bulk insert plus one upsert into the per-song daily rollup. The buffer is
+# bounded: past EVENTS_BUFFER_MAX events are dropped and counted in /metrics, never queued.
+# A batch whose flush fails is retried on its own (new events never wait behind it) up to
+# EVENTS_FLUSH_RETRIES times, then given up and counted as failed.
+EVENT_TYPES = ('play', 'skip', 'seek', 'complete')
+EVENT_ROLLUP_COLUMNS = {'play': 'plays', 'skip': 'skips', 'seek': 'seeks', 'complete': 'completes'}
+EVENTS_MAX_BATCH = 200          # events per POST
+EVENTS_MAX_SKEW = 24 * 3600     # client timestamps further off than this are replaced by server time
+EVENTS_FLUSH_INTERVAL = float(os.environ.get('EVENTS_FLUSH_INTERVAL', 2))
+EVENTS_FLUSH_SIZE = int(os.environ.get('EVENTS_FLUSH_SIZE', 5000))
+EVENTS_BUFFER_MAX = int(os.environ.get('EVENTS_BUFFER_MAX', 100000))
+EVENTS_FLUSH_RETRIES = 3
+EVENT_MAX_SONG_ID = 2**31 - 1   # INTEGER column range
+EVENT_MAX_POSITION = 24 * 3600  # seconds into a track
+
+class EventBuffer:
+    """Thread-safe bounded event buffer drained by a lazily started flusher thread (one per process)."""
+    def __init__(self, flush, interval, flush_size, max_size):
+        self.flush = flush
+        self.interval = interval
+        self.flush_size = flush_size
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._events = []
+        self._retry = [] # [(events, failed attempts)]
+        self._retry_size = 0
+        self._wake = threading.Event()
+        self._thread = None
+        self.accepted = self.dropped = self.flushed = self.failed = 0
+
+    def add(self, events):
+        with self._lock:
+            taken = events[:max(0, self.max_size - len(self._events) - self._retry_size)]
+            self._events.extend(taken)
+            self.accepted += len(taken)
+            self.dropped += len(events) - len(taken)
+            pending = len(self._events)
+            if self._thread is None: # Started on first use so every gunicorn worker gets its own
+                self._thread = threading.Thread(target=self._run, daemon=True, name='event-flusher')
+                self._thread.start()
+        if pending >= self.flush_size:
+            self._wake.set()
+        return len(taken)
+
+    def drain(self):
+        """
+        Flushes earlier failed batches (each on its own) and then everything buffered, in chunks of at
+        most flush_size events (bounded statement size, e.g. SQLite's bind-parameter limit). Returns the events tried.
+        """
+        with self._lock:
+            pending, n = self._events, self.flush_size
+            batches = self._retry + [(pending[i:i + n], 0) for i in range(0, len(pending), n)]
+            self._events, self._retry, self._retry_size = [], [], 0
+        for events, attempts in batches:
+            try:
+                self.flush(events)
+                with self._lock:
+                    self.flushed += len(events)
+            except Exception as e:
+                attempts += 1
+                with self._lock:
+                    if attempts < EVENTS_FLUSH_RETRIES:
+                        self._retry.append((events, attempts))
+                        self._retry_size += len(events)
+                    else:
+                        self.failed += len(events)
+                print(f"Event Flush Error ({len(events)} events, attempt {attempts}/{EVENTS_FLUSH_RETRIES}): {e}")
+        return sum(len(events) for events, _ in batches)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.drain()
+
+    def stats(self):
+        with self._lock:
+            return {'accepted': self.accepted, 'dropped': self.dropped, 'flushed': self.flushed,
+                    'failed': self.failed, 'buffered': len(self._events) + self._retry_size}
+
+def flush_play_events(events):
+    """Bulk-inserts events for known songs and adds them to SongDailyStats, in one transaction."""
+    with app.app_context():
+        known = {sid for (sid,) in db.session.query(Song.id).filter(Song.id.in_({e['song_id'] for e in events}))}
+        events = [e for e in events if e['song_id'] in known]
+        if not events: return
+        db.session.execute(insert(PlayEvent), events)
+
+        rollup = defaultdict(Counter)
+        for e in events:
+            rollup[(e['song_id'], e['occurred_at'].date())][EVENT_ROLLUP_COLUMNS[e['kind']]] += 1
+        columns = list(EVENT_ROLLUP_COLUMNS.values())
+        rows = [{'song_id': sid, 'day': day, **{c: counts[c] for c in columns}}
+                for (sid, day), counts in sorted(rollup.items())] # Fixed order: no upsert deadlocks between workers
+        stmt = _dialect_insert(SongDailyStats)
+        stmt = stmt.on_conflict_do_update(index_elements=['song_id', 'day'],
+                                          set_={c: getattr(SongDailyStats, c) + getattr(stmt.excluded, c) for c in columns})
+        db.session.execute(stmt, rows)
+        db.session.commit()
+
+event_buffer = EventBuffer(flush_play_events, EVENTS_FLUSH_INTERVAL, EVENTS_FLUSH_SIZE, EVENTS_BUFFER_MAX)
+atexit.register(event_buffer.drain) # Graceful worker shutdown keeps what is still buffered
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _parse_event(raw, user_id, now):
+    """Row dict for one posted event, or None if it is malformed or out of range."""
+    if not isinstance(raw, dict) or raw.get('type') not in EVENT_TYPES: return None
+    song_id, position, ts = raw.get('song_id'), raw.get('position'), raw.get('ts')
+    if not isinstance(song_id, int) or isinstance(song_id, bool) or not 0 < song_id <= EVENT_MAX_SONG_ID: return None
+    if position is not None and not (_is_number(position) and 0 <= position <= EVENT_MAX_POSITION): return None
+    occurred_at = now
+    if _is_number(ts) and abs(ts - now.timestamp()) < EVENTS_MAX_SKEW:
+        occurred_at = datetime.fromtimestamp(ts, timezone.utc)
+    return {'user_id': user_id, 'song_id': song_id, 'kind': raw['type'], 'occurred_at': occurred_at.replace(tzinfo=None),
+            'position': float(position) if position is not None else None}
+
+@app.route('/api/events', methods=['POST'])
+@jwt_required(optional=True)
+def ingest_events():
+    """
+    Body: {"events": [{"type": "play|skip|seek|complete", "song_id": 1, "position": 12.5, "ts": unix seconds}]}
+    At most EVENTS_MAX_BATCH per call. Any malformed or out-of-range entry rejects the whole
+    batch with 400 (nothing is buffered). Returns 202 once buffered.
+    """
+    raw = (request.get_json(silent=True) or {}).get('events')
+    if not isinstance(raw, list) or len(raw) > EVENTS_MAX_BATCH:
+        return jsonify({"message": f"events must be a list of at most {EVENTS_MAX_BATCH} items"}), 400
+    now = datetime.now(timezone.utc)
+    events = [_parse_event(r, current_user_id(), now) for r in raw]
+    bad = [i for i, e in enumerate(events) if e is None]
+    if bad:
+        return jsonify({"message": f"Invalid event at index {bad[0]}", "invalid": bad}), 400
+    return jsonify({"accepted": event_buffer.add(events)}), 202
+
+@app.route('/api/songs/top', methods=['GET'])
+def top_songs():
+    """Most played songs over the last ?days=N (default 7, max 90) from the daily rollups. ?limit=N (max 100)."""
+    days = max(1, min(request.args.get('days', 7, type=int), 90))
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    since = _utcnow().date() - timedelta(days=days - 1)
+    plays = func.sum(SongDailyStats.plays)
+    rows = db.session.query(SongDailyStats.song_id, plays).filter(SongDailyStats.day >= since) \
+        .group_by(SongDailyStats.song_id).having(plays > 0).order_by(plays.desc(), SongDailyStats.song_id).limit(limit).all()
+    counts = dict(rows)
+    return jsonify([{**song, 'plays': int(counts[song['id']])} for song in hydrate_songs([sid for sid, _ in rows])])
 
 # --- STANDARD ROUTES ---
+SONG_FIELDS = ('id', 'title', 'artist', 'src', 'cover', 'covers', 'duration', 'loudness')
+SONGS_PAGE_MAX = 500
+
+def song_to_dict(s):
+    return {'id': s.id, 'title': s.title, 'artist': s.artist, 'src': s.src, 'cover': s.cover,
+            'covers': cover_urls(s.cover_hash), 'duration': s.duration, 'loudness': s.loudness}
+
+# In-memory copy of the serialized catalog, rebuilt when the library version moves
+_catalog_lock = threading.Lock()
+_catalog_cache = {'version': None, 'songs': [], 'ids': [], 'bodies': {}}
+
+def get_song_catalog(version):
+    with _catalog_lock:
+        if _catalog_cache['version'] != version:
+            songs = [song_to_dict(s) for s in Song.query.order_by(Song.id).all()]
+            _catalog_cache.update(version=version, songs=songs, ids=[s['id'] for s in songs], bodies={})
+        return _catalog_cache
+
 @app.route('/api/songs', methods=['GET'])
 def get_songs():
-    return jsonify([{'id': s.id, 'title': s.title, 'artist': s.artist, 'src': s.src, 'cover': s.cover} for s in Song.query.all()])
+    """
+    Song catalog.
+    Query params (all optional):
+      fields=id,title,...  projection over SONG_FIELDS (keys come back in SONG_FIELDS order)
+      limit=N              page size (max SONGS_PAGE_MAX); switches the body to {"songs": [...], "next_cursor": id|null}
+      cursor=ID            return songs with id > ID
+    Without limit the full list is returned, as before. Responses carry an ETag tied to the library version.
+    """
+    requested = {f for f in request.args.get('fields', '').split(',') if f}
+    if requested - set(SONG_FIELDS):
+        return jsonify({"message": f"Unknown field. Allowed: {', '.join(SONG_FIELDS)}"}), 400
+    fields = tuple(f for f in SONG_FIELDS if f in requested) or SONG_FIELDS # Canonical order: one cache entry per projection
+    try:
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({"message": "Invalid limit"}), 400
+    try:
+        cursor = int(request.args.get('cursor', 0))
+    except ValueError:
+        return jsonify({"message": "Invalid cursor"}), 400
+    if limit is not None:
+        limit = max(1, min(limit, SONGS_PAGE_MAX))
+
+    version = current_library_version()
+    etag = hashlib.sha1(f"{version}:{','.join(fields)}:{limit}:{cursor}".encode('utf-8')).hexdigest()[:24]
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    catalog = get_song_catalog(version)
+
+    if limit is None:
+        body = catalog['bodies'].get(fields)
+        if body is None:
+            rows = catalog['songs'] if fields == SONG_FIELDS else [{f: s[f] for f in fields} for s in catalog['songs']]
+            body = catalog['bodies'][fields] = json.dumps(rows)
+    else:
+        start = bisect.bisect_right(catalog['ids'], cursor)
+        page = catalog['songs'][start:start + limit]
+        next_cursor = page[-1]['id'] if start + limit < len(catalog['songs']) else None
+        body = json.dumps({'songs': [{f: s[f] for f in fields} for s in page], 'next_cursor': next_cursor})
+
+    resp = Response(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 20, type=int), SEARCH_LIMIT_MAX))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    if not query: return jsonify([])
+    return jsonify(search_songs(query, limit, offset))
+
+@app.route('/api/artist_image', methods=['GET'])
+def artist_image():
+    name = request.args.get('name', '').strip()
+    if not name: return jsonify({"message": "Missing name"}), 400
+    if len(name) > ARTIST_NAME_MAX: return jsonify({"message": f"Name longer than {ARTIST_NAME_MAX} characters"}), 400
+    resp = jsonify({"artist": name, "image_url": get_artist_image(name)})
+    resp.headers['Cache-Control'] = 'public, max-age=300'
+    return resp
 
 @app.route('/api/playlists', methods=['GET'])
 @jwt_required()
 def get_playlists():
-    user_id = get_jwt_identity()
-    user_p = Playlist.query.filter_by(user_id=user_id).all()
-    sys_p = Playlist.query.filter_by(is_system=True).all()
-    output = []
-    for p in sys_p: output.append({'id': p.id, 'name': p.name, 'is_system': True})
-    for p in user_p: output.append({'id': p.id, 'name': p.name, 'is_system': False})
-    return jsonify(output)
+    user_id = current_user_id()
+    # One query: system playlists first, then the user's own (both in creation order)
+    rows = db.session.query(Playlist.id, Playlist.name, Playlist.is_system) \
+        .filter((Playlist.is_system == True) | (Playlist.user_id == user_id)) \
+        .order_by(Playlist.is_system.desc(), Playlist.id).all()
+    return jsonify([{'id': p.id, 'name': p.name, 'is_system': bool(p.is_system)} for p in rows])
 
 @app.route('/api/playlists/<int:playlist_id>', methods=['GET'])
 @jwt_required()
 def get_playlist_details(playlist_id):
-    user_id = get_jwt_identity()
-    playlist = Playlist.query.get(playlist_id)
-    if not playlist: return jsonify({"message": "Not found"}), 404
-    if not playlist.is_system and str(playlist.user_id) != str(user_id): return jsonify({"message": "Access denied"}), 403
-    song_ids = [ps.song_id for ps in PlaylistSong.query.filter_by(playlist_id=playlist_id).all()]
-    songs = Song.query.filter(Song.id.in_(song_ids)).all()
+    """
+    Playlist + its songs in one joined query (songs in insertion order).
+    Optional ?limit=&offset= for big system playlists; "total" is always the full song count.
+    """
+    user_id = current_user_id()
+    limit = request.args.get('limit', type=int)
+    offset = max(0, request.args.get('offset', 0, type=int))
+
+    query = db.session.query(
+        Playlist.id, Playlist.name, Playlist.is_system, Playlist.user_id,
+        Song.id.label('song_id'), Song.title, Song.artist, Song.src, Song.cover, Song.cover_hash,
+        func.count(Song.id).over().label('total'),
+    ).outerjoin(PlaylistSong, PlaylistSong.playlist_id == Playlist.id) \
+     .outerjoin(Song, Song.id == PlaylistSong.song_id) \
+     .filter(Playlist.id == playlist_id).order_by(PlaylistSong.id)
+    if limit is not None:
+        query = query.limit(max(1, limit)).offset(offset)
+    rows = query.all()
+
+    if not rows:
+        # Only reachable when offset is past the end: confirm the playlist exists
+        playlist = db.session.get(Playlist, playlist_id)
+        if not playlist: return jsonify({"message": "Not found"}), 404
+        head = {'id': playlist.id, 'name': playlist.name, 'is_system': playlist.is_system, 'user_id': playlist.user_id}
+        total = PlaylistSong.query.filter_by(playlist_id=playlist_id).count()
+    else:
+        head = rows[0]._mapping
+        total = rows[0].total
+
+    if not head['is_system'] and str(head['user_id']) != str(user_id): return jsonify({"message": "Access denied"}), 403
+    songs = [{'id': r.song_id, 'title': r.title, 'artist': r.artist, 'src': r.src, 'cover': r.cover,
+              'covers': cover_urls(r.cover_hash)} for r in rows if r.song_id is not None]
     return jsonify({
-        "id": playlist.id, "name": playlist.name, "is_system": playlist.is_system,
-        "songs": [{'id': s.id, 'title': s.title, 'artist': s.artist, 'src': s.src, 'cover': s.cover} for s in songs]
+        "id": head['id'], "name": head['name'], "is_system": bool(head['is_system']),
+        "total": total, "songs": songs
     })
 
 @app.route('/api/playlists', methods=['POST'])
 @jwt_required()
 def create_playlist():
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     new_p = Playlist(name=request.get_json().get('name'), user_id=user_id)
     db.session.add(new_p); db.session.commit()
     return jsonify({'id': new_p.id, 'name': new_p.name}), 201
 
+# --- BULK LIKES / PLAYLIST EDITS ---
+# Writes are single INSERT .. SELECT .. ON CONFLICT DO NOTHING statements backed by the
+# uq_liked_song / uq_playlist_song unique indexes, so retries and double clicks are harmless.
+BULK_MAX_IDS = 1000
+
+def _dialect_insert(model):
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql': return pg_insert(model)
+    if dialect == 'sqlite': return sqlite_insert(model)
+    raise NotImplementedError(f"Upserts not supported on {dialect}")
+
+def link_songs(model, owner_column, owner_id, song_ids):
+    """Links existing songs to an owner (user or playlist) in the given order, skipping ones already linked."""
+    if not song_ids: return 0
+    position = case({sid: i for i, sid in enumerate(song_ids)}, value=Song.id)
+    rows = select(literal(owner_id, db.Integer), Song.id).where(Song.id.in_(song_ids)).order_by(position)
+    stmt = _dialect_insert(model).from_select([owner_column, 'song_id'], rows) \
+        .on_conflict_do_nothing(index_elements=[owner_column, 'song_id'])
+    return db.session.execute(stmt).rowcount
+
+def _id_list(value):
+    """Validates a JSON list of song ids (deduped, order kept). Returns None if invalid."""
+    if value is None: return []
+    if not isinstance(value, list) or len(value) > BULK_MAX_IDS: return None
+    if not all(isinstance(v, int) and not isinstance(v, bool) for v in value): return None
+    return list(dict.fromkeys(value))
+
+def _song_id(value):
+    """A single song id from a JSON body, or None if it isn't a positive integer."""
+    return value if isinstance(value, int) and not isinstance(value, bool) and value > 0 else None
+
+def _song_exists(song_id):
+    return db.session.query(Song.id).filter_by(id=song_id).first() is not None
+
+def _bulk_body():
+    data = request.get_json(silent=True) or {}
+    return _id_list(data.get('add')), _id_list(data.get('remove'))
+
 @app.route('/api/playlists/add_song', methods=['POST'])
 @jwt_required()
 def add_song():
-    user_id = get_jwt_identity()
-    data = request.get_json()
-    pid, sid = data.get('playlist_id'), data.get('song_id')
+    user_id = current_user_id()
+    data = request.get_json(silent=True) or {}
+    pid, sid = data.get('playlist_id'), _song_id(data.get('song_id'))
+    if sid is None: return jsonify({"message": "song_id must be a positive integer"}), 400
     if not Playlist.query.filter_by(id=pid, user_id=user_id).first(): return jsonify({"message": "Error"}), 404
-    if not PlaylistSong.query.filter_by(playlist_id=pid, song_id=sid).first():
-        db.session.add(PlaylistSong(playlist_id=pid, song_id=sid)); db.session.commit()
+    if not link_songs(PlaylistSong, 'playlist_id', pid, [sid]) and not _song_exists(sid): # 0 rows: already linked, or no such song
+        return jsonify({"message": "Song not found"}), 404
+    db.session.commit()
     return jsonify({"message": "Added"}), 200
 
+@app.route('/api/playlists/<int:playlist_id>/songs', methods=['POST'])
+@jwt_required()
+def bulk_playlist_songs(playlist_id):
+    """Body: {"add": [song ids], "remove": [song ids]} (removals applied first). Returns the playlist's song ids in order."""
+    user_id = current_user_id()
+    add, remove = _bulk_body()
+    if add is None or remove is None: return jsonify({"message": f"add/remove must be lists of at most {BULK_MAX_IDS} song ids"}), 400
+    if not Playlist.query.filter_by(id=playlist_id, user_id=user_id).first(): return jsonify({"message": "Error"}), 404
+
+    if remove:
+        PlaylistSong.query.filter(PlaylistSong.playlist_id == playlist_id, PlaylistSong.song_id.in_(remove)).delete(synchronize_session=False)
+    link_songs(PlaylistSong, 'playlist_id', playlist_id, add)
+    db.session.commit()
+
+    song_ids = [sid for (sid,) in db.session.query(PlaylistSong.song_id).filter_by(playlist_id=playlist_id).order_by(PlaylistSong.id)]
+    return jsonify({"id": playlist_id, "song_ids": song_ids})
+
 @app.route('/api/likes', methods=['GET'])
 @jwt_required()
 def get_likes():
-    return jsonify([l.song_id for l in LikedSong.query.filter_by(user_id=get_jwt_identity()).all()])
+    return jsonify([l.song_id for l in LikedSong.query.filter_by(user_id=current_user_id()).all()])
 
 @app.route('/api/likes', methods=['POST'])
 @jwt_required()
 def toggle_like():
-    user_id = get_jwt_identity(); sid = request.get_json().get('song_id')
-    existing = LikedSong.query.filter_by(user_id=user_id, song_id=sid).first()
-    if existing: db.session.delete(existing); db.session.commit(); return jsonify({"status": "removed"})
-    db.session.add(LikedSong(user_id=user_id, song_id=sid)); db.session.commit(); return jsonify({"status": "added"})
+    user_id = current_user_id(); sid = _song_id((request.get_json(silent=True) or {}).get('song_id'))
+    if sid is None: return jsonify({"message": "song_id must be a positive integer"}), 400
+    removed = LikedSong.query.filter_by(user_id=user_id, song_id=sid).delete(synchronize_session=False)
+    if removed: db.session.commit(); return jsonify({"status": "removed"})
+    if not link_songs(LikedSong, 'user_id', user_id, [sid]): return jsonify({"message": "Song not found"}), 404 # Not liked, so the song is missing
+    update_recommendations_for_likes(user_id, [sid])
+    db.session.commit(); return jsonify({"status": "added"})
+
+@app.route('/api/likes/bulk', methods=['POST'])
+@jwt_required()
+def bulk_likes():
+    """Body: {"add": [song ids], "remove": [song ids]} (removals applied first). Returns the liked song ids."""
+    user_id = current_user_id()
+    add, remove = _bulk_body()
+    if add is None or remove is None: return jsonify({"message": f"add/remove must be lists of at most {BULK_MAX_IDS} song ids"}), 400
+
+    if remove:
+        LikedSong.query.filter(LikedSong.user_id == user_id, LikedSong.song_id.in_(remove)).delete(synchronize_session=False)
+    if link_songs(LikedSong, 'user_id', user_id, add): update_recommendations_for_likes(user_id, add)
+    db.session.commit()
+
+    return jsonify([sid for (sid,) in db.session.query(LikedSong.song_id).filter_by(user_id=user_id).order_by(LikedSong.id)])
+
+# --- AUTH ---
+# bcrypt is deliberately slow (~0.25s of CPU at cost 12), so hashes are computed in a small
+# process pool instead of on the request worker: a login burst queues on the pool rather than
+# in front of every other API call. BCRYPT_ROUNDS sets the work factor; stored hashes with a
+# different cost are rehashed on the next successful login. AUTH_HASH_WORKERS=0 hashes inline.
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+BCRYPT_MAX_PASSWORD_BYTES = 72 # bcrypt ignores (5.x: rejects) anything longer
+AUTH_HASH_WORKERS = int(os.environ.get('AUTH_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+AUTH_HASH_QUEUE = int(os.environ.get('AUTH_HASH_QUEUE', 32)) # Hashes running or waiting, per web process
+AUTH_HASH_TIMEOUT = float(os.environ.get('AUTH_HASH_TIMEOUT', 10))
+LOGIN_IP_LIMIT = os.environ.get('LOGIN_IP_LIMIT', '30/minute')
+LOGIN_ACCOUNT_LIMIT = os.environ.get('LOGIN_ACCOUNT_LIMIT', '10/15 minutes') # Failed attempts only
+SIGNUP_IP_LIMIT = os.environ.get('SIGNUP_IP_LIMIT', '10/hour')
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+_hash_slots = threading.BoundedSemaphore(max(1, AUTH_HASH_QUEUE))
+
+class AuthBusy(Exception):
+    """The hash pool is saturated or a hash timed out; the client should retry shortly."""
+
+def _get_hash_pool():
+    global _hash_pool
+    if _hash_pool is None:
+        with _hash_pool_lock:
+            if _hash_pool is None:
+                # forkserver: workers are not forked from a threaded web process
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                _hash_pool = ProcessPoolExecutor(max_workers=AUTH_HASH_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _hash_pool
+
+def _run_hash(fn, *args):
+    """Runs a bcrypt function in the hash pool (bounded by AUTH_HASH_QUEUE)."""
+    global _hash_pool
+    with track_external('bcrypt'):
+        if AUTH_HASH_WORKERS <= 0:
+            return fn(*args)
+        if not _hash_slots.acquire(timeout=AUTH_HASH_TIMEOUT):
+            raise AuthBusy()
+        try:
+            future = _get_hash_pool().submit(fn, *args)
+        except BaseException:
+            _hash_slots.release()
+            raise
+        future.add_done_callback(lambda _: _hash_slots.release()) # The slot is held until the hash really ends
+        try:
+            return future.result(timeout=AUTH_HASH_TIMEOUT)
+        except FutureTimeout:
+            future.cancel() # Only possible while still queued; a running hash finishes in the pool
+            raise AuthBusy()
+        except BrokenProcessPool:
+            _hash_pool = None # A worker died; start a fresh pool on the next call
+            raise
+
+def hash_password(password, rounds=None):
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
+    return _run_hash(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+def check_password(password, hashed):
+    try:
+        return _run_hash(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError: # Malformed stored hash or over-long password
+        return False
+
+def password_cost(hashed):
+    """Work factor of a stored bcrypt hash ('$2b$12$...' -> 12)."""
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+def _login_account_key():
+    email = (request.get_json(silent=True) or {}).get('email') or ''
+    return f"account:{str(email).strip().lower()}"
+
+@app.errorhandler(429)
+def rate_limited(e):
+    return jsonify({"message": "Too many attempts, please try again later"}), 429
+
+@app.errorhandler(AuthBusy)
+def auth_busy(e):
+    return jsonify({"message": "Server busy, please try again"}), 503, {'Retry-After': '1'}
 
 @app.route('/api/signup', methods=['POST'])
+@limiter.limit(SIGNUP_IP_LIMIT)
 def signup():
     data = request.get_json()
+    if len(data['password'].encode('utf-8')) > BCRYPT_MAX_PASSWORD_BYTES:
+        return jsonify({"message": f"Password must be at most {BCRYPT_MAX_PASSWORD_BYTES} bytes"}), 400
     
     # Pre-check (Fast)
     if User.query.filter_by(email=data['email']).first():
         return jsonify({"message": "Email already registered"}), 400
         
-    hashed = bcrypt.generate_password_hash(data['password']).decode('utf-8')
+    hashed = hash_password(data['password'])
     new_user = User(name=data['name'], email=data['email'], password=hashed)
     
     try:
@@ -437,10 +2710,15 @@ def signup():
         return jsonify({"message": "Error creating account"}), 500
 
 @app.route('/api/login', methods=['POST'])
+@limiter.limit(LOGIN_IP_LIMIT)
+@limiter.limit(LOGIN_ACCOUNT_LIMIT, key_func=_login_account_key, deduct_when=lambda resp: resp.status_code == 401)
 def login():
     data = request.get_json()
     user = User.query.filter_by(email=data['email']).first()
-    if user and bcrypt.check_password_hash(user.password, data['password']):
+    if user and check_password(data['password'], user.password):
+        if password_cost(user.password) != BCRYPT_ROUNDS: # Work factor changed: upgrade the stored hash
+            user.password = hash_password(data['password'])
+            db.session.commit()
         token = create_access_token(identity=str(user.id))
         return jsonify({"token": token, "user": {"id": user.id, "name": user.name}}), 200
     return jsonify({"message": "Invalid"}), 401
@@ -449,28 +2727,15 @@ def login():
 @app.route('/api/user/me', methods=['GET'])
 @jwt_required()
 def get_current_user():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_user()
     if not user: return jsonify({"message": "User not found"}), 404
-    
-    # Filter out legacy file paths that are broken on Render
-    p_pic = user.profile_pic
-    if p_pic and p_pic.startswith('/assets/users/'):
-        p_pic = None
-    
-    return jsonify({
-        "id": user.id,
-        "name": user.name,
-        "email": user.email,
-        "profile_pic": p_pic
-    })
+    return jsonify(user)
 
 @app.route('/api/user/upload_profile_pic', methods=['POST'])
 @jwt_required()
 def upload_profile_pic():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
-    if not user: return jsonify({"message": "User not found"}), 404
+    user_id = current_user_id()
+    if not current_user(): return jsonify({"message": "User not found"}), 404
 
     if 'image' not in request.files:
         return jsonify({"message": "No file part"}), 400
@@ -481,67 +2746,166 @@ def upload_profile_pic():
 
     if file:
         try:
-            # Read bytes and convert to Base64
-            file_data = file.read()
-            b64_str = base64.b64encode(file_data).decode('utf-8')
-            
-            # Create Data URI
-            mime_type = file.content_type or "image/jpeg"
-            data_uri = f"data:{mime_type};base64,{b64_str}"
-
-            # Update DB (Persistent Storage)
-            user.profile_pic = data_uri
+            url = store_profile_pic(file.read(), file.content_type)
+
+            # Update DB (row only keeps the URL)
+            User.query.filter_by(id=user_id).update({User.profile_pic: url}, synchronize_session=False)
             db.session.commit()
+            invalidate_user(user_id)
 
-            return jsonify({"message": "Uploaded successfully", "profile_pic": data_uri})
+            return jsonify({"message": "Uploaded successfully", "profile_pic": url})
+        except ValueError:
+            db.session.rollback()
+            return jsonify({"message": "File is not a valid image"}), 400
         except Exception as e:
+             db.session.rollback()
              print(f"Upload Error: {e}")
              return jsonify({"message": "Upload failed"}), 500
 
+@app.route('/api/media/<path:key>', methods=['GET'])
+def serve_media(key):
+    if request.if_none_match.contains(key):
+        resp = Response(status=304)
+        resp.set_etag(key)
+        return resp
+    found = blob_store.get(key)
+    if not found: return jsonify({"message": "Not found"}), 404
+    data, content_type = found
+    resp = Response(data, mimetype=content_type)
+    resp.set_etag(key)
+    resp.headers['Cache-Control'] = MEDIA_CACHE_CONTROL
+    return resp
+
 # --- RUNNER ---
+# Web workers only serve requests. One-shot setup (schema, migrations, library scan, cover thumbnails) runs as
+#   flask --app app init [--full]     (or: python init_db.py)
+# and background jobs (metadata fixer, artist prefetch) as
+#   flask --app app worker
+# Set RUN_BACKGROUND_JOBS=1 to run the jobs inside the web process instead (leases keep them single).
+INIT_LOCK_KEY = 0x5248594D # 'RHYM'
 
-# Initialize App Logic (Runs on Import/Gunicorn Start)
-def initialize_app():
-    with app.app_context():
+@contextmanager
+def init_lock():
+    """Serializes concurrent init runs: Postgres advisory lock, or a file lock for SQLite."""
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {'key': INIT_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': INIT_LOCK_KEY})
+                conn.commit()
+        return
+
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, 'init.lock'), 'w') as lock_file:
+        if fcntl: fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl: fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def initialize_app(full_scan=False):
+    """One-shot setup: tables, migrations, indexes, a library scan and cover thumbnails. Safe to run concurrently."""
+    with app.app_context(), init_lock():
+        t0 = time.perf_counter()
+        db.create_all()
+        
+        # MIGRATION: Attempt to add/update profile_pic column safely
         try:
-            db.create_all()
-            
-            # MIGRATION: Attempt to add/update profile_pic column safely
+            with db.engine.connect() as conn:
+                # 1. Try adding if missing
+                try:
+                    conn.execute(text('ALTER TABLE "user" ADD COLUMN profile_pic TEXT'))
+                    conn.commit()
+                    print("Migrated: Added profile_pic column")
+                except Exception:
+                    # 2. If exists, ensure it is TEXT (for Base64 support)
+                    conn.rollback() # Reset transaction after error
+                    conn.execute(text('ALTER TABLE "user" ALTER COLUMN profile_pic TYPE TEXT'))
+                    conn.commit()
+                    print("Migrated: Updated profile_pic to TEXT")
+        except Exception as e:
+            print(f"Migration Note: {e}")
+
+        ensure_columns()
+        ensure_indexes()
+        ensure_search_index()
+        migrate_profile_pics()
+        
+        # Scan Library (Fast), then thumbnail new covers
+        scan_library(full=full_scan)
+        generate_cover_thumbnails()
+        print(f"Init: done in {time.perf_counter() - t0:.2f}s")
+
+def start_background_jobs():
+    """Starts the artist prefetch, For You rebuild, transcoder and metadata fixer as daemon threads. Returns the threads."""
+    def run_artist_prefetch():
+        with app.app_context():
             try:
-                with db.engine.connect() as conn:
-                    from sqlalchemy import text
-                    # 1. Try adding if missing
-                    try:
-                        conn.execute(text('ALTER TABLE "user" ADD COLUMN profile_pic TEXT'))
-                        conn.commit()
-                        print("Migrated: Added profile_pic column")
-                    except Exception:
-                        # 2. If exists, ensure it is TEXT (for Base64 support)
-                        conn.rollback() # Reset transaction after error
-                        conn.execute(text('ALTER TABLE "user" ALTER COLUMN profile_pic TYPE TEXT'))
-                        conn.commit()
-                        print("Migrated: Updated profile_pic to TEXT")
+                prefetch_artist_images()
             except Exception as e:
-                print(f"Migration Note: {e}")
-            
-            # Scan Library (Fast)
-            scan_library()
-
-            # Background Metadata Fixer (Slow)
-            if model:
-                def run_background_fix():
-                    with app.app_context():
-                        auto_fix_metadata()
-                
-                thread = threading.Thread(target=run_background_fix)
-                thread.daemon = True
-                thread.start()
-                
-        except Exception as e:
-            print(f"Initialization Error: {e}")
+                print(f"Artist Prefetch Error: {e}")
+
+    def run_background_fix():
+        with app.app_context():
+            auto_fix_metadata()
+
+    threads = [threading.Thread(target=run_artist_prefetch, daemon=True),
+               threading.Thread(target=run_recommendations_job, daemon=True),
+               threading.Thread(target=run_transcode_job, daemon=True)]
+    if get_model():
+        threads.append(threading.Thread(target=run_background_fix, daemon=True))
+    for thread in threads:
+        thread.start()
+    return threads
+
+@app.cli.command('init')
+@click.option('--full', is_flag=True, help='Re-check every file, not only changed ones.')
+def init_command(full):
+    """Create tables, run migrations, scan the music library and thumbnail new covers."""
+    initialize_app(full_scan=full)
+
+@app.cli.command('build-recommendations')
+def build_recommendations_command():
+    """Rebuild the For You tables now."""
+    stats = build_recommendations()
+    print(f"Recommendations: {stats['users']} users, {stats['songs']} songs in {stats['seconds']}s")
+
+@app.cli.command('transcode')
+@click.option('--limit', type=int, default=None, help='Stop after this many songs.')
+def transcode_command(limit):
+    """Encode lower-bitrate variants (and measure duration/loudness) for new or changed songs."""
+    if transcode_library(limit=limit) is None:
+        raise click.ClickException("ffmpeg and ffprobe must be on the PATH")
+
+@app.cli.command('thumbnails')
+@click.option('--limit', type=int, default=None, help='Stop after this many songs.')
+def thumbnails_command(limit):
+    """Render WebP cover thumbnails for new or changed songs."""
+    if generate_cover_thumbnails(limit=limit) is None:
+        raise click.ClickException("Pillow is required: pip install Pillow")
+
+@app.cli.command('build-static')
+def build_static_command():
+    """Precompress the frontend build (br/gzip) and write its manifest. Run after `npm run build`."""
+    if not os.path.isdir(DIST_DIR):
+        raise click.ClickException(f"{DIST_DIR} not found; run `npm run build` first")
+    manifest = build_static()
+    variants = sum(len(entry['variants']) for entry in manifest.values())
+    print(f"Static: {len(manifest)} files, {variants} precompressed variants{'' if brotli else ' (gzip only: pip install Brotli for .br)'}")
+
+@app.cli.command('worker')
+def worker_command():
+    """Run background jobs (metadata fixer, artist image prefetch, For You rebuild, transcoding) in the foreground."""
+    threads = start_background_jobs()
+    for thread in threads:
+        thread.join()
 
-# Run initialization
-initialize_app()
+if os.environ.get('RUN_BACKGROUND_JOBS') == '1':
+    start_background_jobs()
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    initialize_app()
+    start_background_jobs()
+    app.run(debug=True, port=5000)
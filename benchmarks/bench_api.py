@@ -0,0 +1,188 @@
+"""
+API load test.
+
+Seeds synthetic catalogs (songs, system playlists, users with likes and playlists) through the
+app's models, serves the app on a local threaded server and drives the main endpoints with
+concurrent clients. The Smart DJ model is replaced by a local stub (STUB_MODEL_DELAY seconds).
+
+Reports p50/p95/p99 latency, throughput, error count and SQL statements per request (from /metrics),
+and writes everything to a JSON file. Pass --baseline to fail when a run regresses.
+
+    python benchmarks/bench_api.py --sizes 1000 10000 100000 --concurrency 8 --requests 300
+    DATABASE_URL=postgresql://localhost/rhymic_bench python benchmarks/bench_api.py
+    python benchmarks/bench_api.py --baseline benchmarks/results/last.json --tolerance 0.25
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from benchlib import STUB_MODEL_DELAY, StubModel, percentile, seed_catalog, seed_users # noqa: E402
+
+PASSWORD = 'bench-password'
+PROMPTS = ["hindi", "party", "sad songs", "rap", "romantic evening", "retro classics", "workout", "english modern"]
+
+
+def scenarios(ctx):
+    """name -> (method, path factory, needs auth, json body factory)"""
+    return {
+        'songs': ('GET', lambda i: '/api/songs', False, None),
+        'songs_page': ('GET', lambda i: '/api/songs?limit=100', False, None),
+        'system_playlist': ('GET', lambda i: f"/api/playlists/{ctx['system_playlist']}?limit=100", True, None),
+        'user_playlist': ('GET', lambda i: f"/api/playlists/{ctx['user_playlist']}", True, None),
+        'likes': ('GET', lambda i: '/api/likes', True, None),
+        'login': ('POST', lambda i: '/api/login', False,
+                  lambda i: {'email': f"bench{i % ctx['users']}@example.com", 'password': PASSWORD}),
+        'recommend': ('POST', lambda i: '/api/ai/recommend', True, lambda i: {'prompt': PROMPTS[i % len(PROMPTS)]}),
+    }
+
+
+def scrape_queries(base_url):
+    """route -> (sum, count) of rhymic_request_db_queries from /metrics."""
+    out = {}
+    text = requests.get(f"{base_url}/metrics", timeout=10).text
+    for kind, route, value in re.findall(r'rhymic_request_db_queries_(sum|count)\{route="([^"]*)"\} (\S+)', text):
+        total = out.setdefault(route, [0.0, 0.0])
+        total[0 if kind == 'sum' else 1] = float(value)
+    return out
+
+
+def run_scenario(base_url, name, spec, token, concurrency, total):
+    method, path_for, auth, body_for = spec
+    local = threading.local()
+    headers = {'Authorization': f"Bearer {token}"} if auth else {}
+
+    def one(i):
+        session = getattr(local, 'session', None) or setattr(local, 'session', requests.Session()) or local.session
+        t0 = time.perf_counter()
+        resp = session.request(method, base_url + path_for(i), headers=headers,
+                               json=body_for(i) if body_for else None, timeout=60)
+        return (time.perf_counter() - t0) * 1000, resp.status_code
+
+    before = scrape_queries(base_url)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, range(total)))
+    wall = time.perf_counter() - t0
+    after = scrape_queries(base_url)
+
+    latencies = [ms for ms, _ in samples]
+    query_deltas = {route: (after[route][0] - before.get(route, [0, 0])[0], after[route][1] - before.get(route, [0, 0])[1])
+                    for route in after}
+    route_sum, route_count = max(query_deltas.values(), key=lambda v: v[1]) if query_deltas else (0, 0)
+    return {
+        'endpoint': name,
+        'requests': total,
+        'errors': sum(1 for _, status in samples if status >= 400),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'rps': round(total / wall, 1),
+        'queries_per_request': round(route_sum / route_count, 2) if route_count else None,
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = {(r['songs'], r['endpoint']): r for r in json.load(f)['results']}
+    regressions = []
+    for r in results:
+        old = baseline.get((r['songs'], r['endpoint']))
+        if not old: continue
+        if r['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{r['endpoint']}@{r['songs']}: p95 {old['p95_ms']}ms -> {r['p95_ms']}ms")
+        if (r['queries_per_request'] or 0) > (old['queries_per_request'] or 0):
+            regressions.append(f"{r['endpoint']}@{r['songs']}: queries/request {old['queries_per_request']} -> {r['queries_per_request']}")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint per catalog size')
+    parser.add_argument('--endpoints', nargs='+', help='subset of endpoints to run')
+    parser.add_argument('--out', default=os.path.join(ROOT, 'benchmarks', 'results', f"api-{time.strftime('%Y%m%d-%H%M%S')}.json"))
+    parser.add_argument('--baseline', help='previous results JSON; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown vs. baseline')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.setdefault('GOOGLE_API_KEY', 'stub')
+    os.environ.setdefault('RATELIMIT_ENABLED', '0') # The login scenario would trip the per-IP limit
+    import app as A
+    from werkzeug.serving import make_server
+
+    A.initialize_app()
+    A.model = StubModel()
+    with A.app.app_context():
+        database = A.db.engine.dialect.name
+    logging.getLogger('werkzeug').setLevel(logging.ERROR) # No per-request access log
+    server = make_server('127.0.0.1', 0, A.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    results, seeded = [], 0
+    for size in sorted(args.sizes):
+        with A.app.app_context():
+            t0 = time.perf_counter()
+            seed_catalog(A, size - seeded, seeded)
+            seeded = size
+            user_ids = seed_users(A, args.users, PASSWORD)
+            ctx = {
+                'users': args.users,
+                'system_playlist': A.db.session.query(A.Playlist.id).filter_by(is_system=True).order_by(A.Playlist.id).first()[0],
+                'user_playlist': A.db.session.query(A.Playlist.id).filter_by(user_id=user_ids[0]).first()[0],
+            }
+            print(f"Seeded {size} songs in {time.perf_counter() - t0:.1f}s")
+
+        token = requests.post(f"{base_url}/api/login", json={'email': 'bench0@example.com', 'password': PASSWORD}).json()['token']
+        for name, spec in scenarios(ctx).items():
+            if args.endpoints and name not in args.endpoints: continue
+            row = {'songs': size, **run_scenario(base_url, name, spec, token, args.concurrency, args.requests)}
+            results.append(row)
+            print(f"{size:>7} {name:<16} p50 {row['p50_ms']:>8.2f}  p95 {row['p95_ms']:>8.2f}  p99 {row['p99_ms']:>8.2f}  "
+                  f"{row['rps']:>7.1f} req/s  {row['queries_per_request']} q/req  {row['errors']} errors")
+
+    server.shutdown()
+    os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump({
+            'meta': {'database': database, 'git': git_revision(),
+                     'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'concurrency': args.concurrency,
+                     'requests': args.requests, 'users': args.users, 'stub_model_delay': STUB_MODEL_DELAY},
+            'results': results,
+        }, f, indent=2)
+    print(f"Wrote {args.out}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
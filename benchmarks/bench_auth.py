@@ -0,0 +1,117 @@
+"""
+Auth throughput benchmark.
+
+1. Raw hashing: bcrypt hashes/s at each work factor, inline vs. through the hash process pool.
+2. Login burst: many concurrent /api/login calls against a local threaded server while a probe
+   keeps requesting /api/songs, inline vs. pooled. Reports login throughput/latency and how much
+   the burst slows down unrelated requests.
+
+    python benchmarks/bench_auth.py --rounds 10 12 --logins 200 --concurrency 16 --workers 4
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from benchlib import percentile, seed_catalog # noqa: E402
+
+PASSWORD = 'bench-password'
+
+
+def hash_throughput(A, rounds, n, concurrency):
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda _: A.hash_password(PASSWORD, rounds), range(n)))
+    return n / (time.perf_counter() - t0)
+
+
+def login_burst(base_url, n_users, n_logins, concurrency):
+    """Fires n_logins logins; meanwhile a probe thread times /api/songs. Returns (login ms, probe ms, wall s)."""
+    session = requests.Session()
+    probe_ms, done = [], threading.Event()
+
+    def probe():
+        s = requests.Session()
+        while not done.is_set():
+            t0 = time.perf_counter()
+            s.get(f"{base_url}/api/songs?limit=50")
+            probe_ms.append((time.perf_counter() - t0) * 1000)
+            time.sleep(0.01)
+
+    def login(i):
+        t0 = time.perf_counter()
+        r = session.post(f"{base_url}/api/login", json={'email': f"auth{i % n_users}@example.com", 'password': PASSWORD})
+        return (time.perf_counter() - t0) * 1000, r.status_code
+
+    prober = threading.Thread(target=probe, daemon=True)
+    prober.start()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(login, range(n_logins)))
+    wall = time.perf_counter() - t0
+    done.set()
+    prober.join()
+    errors = sum(1 for _, status in results if status != 200)
+    return sorted(ms for ms, _ in results), sorted(probe_ms), wall, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 12])
+    parser.add_argument('--hashes', type=int, default=40, help='hashes per raw throughput run')
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1), help='AUTH_HASH_WORKERS for pooled runs')
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ['RATELIMIT_ENABLED'] = '0'
+    os.environ['AUTH_HASH_QUEUE'] = str(max(args.concurrency, args.workers))
+    import app as A
+    from werkzeug.serving import make_server
+
+    A.initialize_app()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    with A.app.app_context():
+        seed_catalog(A, 1000)
+    server = make_server('127.0.0.1', 0, A.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    modes = [('inline', 0), (f"pool x{args.workers}", args.workers)]
+    print(f"{'rounds':>6} {'mode':<10} {'hash/s':>8}")
+    for rounds in args.rounds:
+        for label, workers in modes:
+            A.AUTH_HASH_WORKERS = workers
+            print(f"{rounds:>6} {label:<10} {hash_throughput(A, rounds, args.hashes, args.concurrency):>8.1f}")
+
+    print(f"\n{'rounds':>6} {'mode':<10} {'login/s':>8} {'login p50':>10} {'login p95':>10} {'songs p50':>10} {'songs p95':>10} errors")
+    for rounds in args.rounds:
+        A.BCRYPT_ROUNDS = rounds
+        with A.app.app_context():
+            A.User.query.filter(A.User.email.like('auth%@example.com')).delete(synchronize_session=False)
+            hashed = A.hash_password(PASSWORD, rounds)
+            A.db.session.add_all([A.User(name=f"Auth {i}", email=f"auth{i}@example.com", password=hashed) for i in range(args.users)])
+            A.db.session.commit()
+        for label, workers in modes:
+            A.AUTH_HASH_WORKERS = workers
+            logins, probes, wall, errors = login_burst(base_url, args.users, args.logins, args.concurrency)
+            print(f"{rounds:>6} {label:<10} {args.logins / wall:>8.1f} {percentile(logins, 50):>10.1f} {percentile(logins, 95):>10.1f} "
+                  f"{percentile(probes, 50):>10.1f} {percentile(probes, 95):>10.1f} {errors}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Serving-mode concurrency test.
+
+Starts gunicorn (gunicorn.conf.py, app wrapped by stub_app.py so Smart DJ calls hit a local stub
+that sleeps STUB_MODEL_DELAY seconds) once per worker class. Keeps --slow clients busy on
+/api/ai/recommend with uncached prompts while a probe times cheap endpoints (catalog page,
+playlist, likes). With sync workers the probe queues behind the model calls; with gthread or
+gevent it should stay in the milliseconds.
+
+Pass/fail: every mode not listed in --baseline (default: sync, which is expected to block) must
+keep each probe's p95 under --max-probe-ms, answer every probe and complete some model calls.
+The script exits 1 if any checked mode fails, so it can gate a serving-config change.
+
+    python benchmarks/bench_concurrency.py --modes sync gthread --slow 8 --duration 15
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from benchlib import percentile, seed_catalog, seed_users # noqa: E402
+
+PASSWORD = 'bench-password'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(mode, env, port, workers, threads):
+    env = dict(env, GUNICORN_WORKER_CLASS=mode, WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads))
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                             '--pythonpath', f"{ROOT},{BENCH_DIR}", '--bind', f"127.0.0.1:{port}", 'stub_app:app'],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/api/ai/stats", timeout=1)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"gunicorn ({mode}) did not start")
+
+
+def run_load(base_url, headers, probes, slow_clients, duration):
+    stop = threading.Event()
+    slow_ms, probe_ms, errors = [], {path: [] for path in probes}, [0]
+
+    def slow_client(n):
+        i = 0
+        while not stop.is_set():
+            i += 1
+            t0 = time.perf_counter()
+            try:
+                requests.post(f"{base_url}/api/ai/recommend", json={'prompt': f"mood {n} {i} {time.time()}"},
+                              headers=headers, timeout=120)
+                slow_ms.append((time.perf_counter() - t0) * 1000)
+            except requests.RequestException:
+                errors[0] += 1
+
+    def probe():
+        session = requests.Session()
+        while not stop.is_set():
+            for path in probes:
+                t0 = time.perf_counter()
+                try:
+                    session.get(f"{base_url}{path}", headers=headers, timeout=120)
+                    probe_ms[path].append((time.perf_counter() - t0) * 1000)
+                except requests.RequestException:
+                    errors[0] += 1
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=slow_client, args=(n,), daemon=True) for n in range(slow_clients)]
+    threads.append(threading.Thread(target=probe, daemon=True))
+    for t in threads: t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads: t.join()
+    return slow_ms, probe_ms, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=['sync', 'gthread'])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--slow', type=int, default=8, help='concurrent Smart DJ clients')
+    parser.add_argument('--delay', type=float, default=2.0, help='stub model delay in seconds')
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--songs', type=int, default=5000)
+    parser.add_argument('--max-probe-ms', type=float, default=500, help='p95 bound for the probes in checked modes')
+    parser.add_argument('--baseline', nargs='*', default=['sync'], help='modes that are only reported, not checked')
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    env = dict(os.environ, DATABASE_URL=os.environ.get('DATABASE_URL') or f"sqlite:///{db_path}",
+               GOOGLE_API_KEY='stub', STUB_MODEL_DELAY=str(args.delay), RATELIMIT_ENABLED='0')
+    os.environ.update(env)
+    import app as A
+    from flask_jwt_extended import create_access_token
+
+    A.initialize_app()
+    with A.app.app_context():
+        seed_catalog(A, args.songs)
+        user_id = seed_users(A, 1, PASSWORD)[0]
+        playlist_id = A.db.session.query(A.Playlist.id).filter_by(is_system=True).first()[0]
+        headers = {'Authorization': f"Bearer {create_access_token(identity=str(user_id))}"}
+    probes = ['/api/songs?limit=50', f"/api/playlists/{playlist_id}?limit=50", '/api/likes']
+
+    print(f"{args.slow} Smart DJ clients x {args.delay}s stub, {args.workers} workers, {args.threads} threads, {args.duration}s per mode")
+    failures = []
+    for mode in args.modes:
+        port = free_port()
+        proc = start_gunicorn(mode, env, port, args.workers, args.threads)
+        try:
+            slow_ms, probe_ms, errors = run_load(f"http://127.0.0.1:{port}", headers, probes, args.slow, args.duration)
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(timeout=60)
+        checked = mode not in args.baseline
+        print(f"\n[{mode}]{'' if checked else ' (baseline, not checked)'} recommend: {len(slow_ms)} done, "
+              f"p50 {percentile(slow_ms, 50) if slow_ms else 0:.0f} ms, errors {errors}")
+        problems = []
+        if errors: problems.append(f"{errors} request errors")
+        if not slow_ms: problems.append("no Smart DJ call completed (load never applied)")
+        for path, values in probe_ms.items():
+            if not values:
+                print(f"  {path:<28} no responses")
+                problems.append(f"{path}: no responses")
+                continue
+            p95 = percentile(values, 95)
+            print(f"  {path:<28} n={len(values):<5} p50 {percentile(values, 50):>8.1f}  p95 {p95:>8.1f}  max {max(values):>8.1f} ms")
+            if p95 > args.max_probe_ms: problems.append(f"{path}: p95 {p95:.0f} ms > {args.max_probe_ms:.0f} ms")
+        if checked:
+            print(f"  {'FAIL' if problems else 'PASS'}{': ' + '; '.join(problems) if problems else ''}")
+            failures += [f"{mode}: {p}" for p in problems]
+
+    if failures:
+        print(f"\nFAILED ({len(failures)}):\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("\nOK: probes stayed responsive in every checked mode")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Play-event ingestion benchmark.
+
+1. Ingest: concurrent clients POST batches to /api/events on a local threaded server
+   (what the player does); reports events/s and request latency. No DB work on this path.
+2. Flush: drains buffers of increasing size through flush_play_events (bulk insert + rollup
+   upsert); reports events/s the flusher sustains.
+
+    python benchmarks/bench_events.py --clients 8 --batch 50 --requests 2000
+    DATABASE_URL=postgresql://localhost/rhymic_bench python benchmarks/bench_events.py
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from benchlib import percentile, seed_catalog # noqa: E402
+
+KINDS = ['play'] * 6 + ['skip'] * 2 + ['seek', 'complete']
+
+
+def make_events(rng, n, max_song):
+    now = time.time()
+    return [{'type': rng.choice(KINDS), 'song_id': rng.randint(1, max_song), 'position': round(rng.uniform(0, 240), 1),
+             'ts': now - rng.uniform(0, 3600)} for _ in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--songs', type=int, default=10000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=50, help='events per POST')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--flush-sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ['EVENTS_FLUSH_INTERVAL'] = '3600' # Flushes are timed separately below
+    os.environ['EVENTS_FLUSH_SIZE'] = '100000000'
+    os.environ['EVENTS_BUFFER_MAX'] = '100000000'
+    import app as A
+    from werkzeug.serving import make_server
+
+    A.initialize_app()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    with A.app.app_context():
+        seed_catalog(A, args.songs)
+    server = make_server('127.0.0.1', 0, A.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/api/events"
+
+    rng = random.Random(1)
+    bodies = [{'events': make_events(rng, args.batch, args.songs)} for _ in range(min(args.requests, 200))]
+    local = threading.local()
+
+    def post(i):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        t0 = time.perf_counter()
+        r = local.session.post(url, json=bodies[i % len(bodies)])
+        return (time.perf_counter() - t0) * 1000, r.status_code
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as pool:
+        results = list(pool.map(post, range(args.requests)))
+    wall = time.perf_counter() - t0
+    latencies = sorted(ms for ms, _ in results)
+    errors = sum(1 for _, status in results if status != 202)
+    print(f"ingest: {args.requests} POSTs x {args.batch} events, {args.clients} clients: "
+          f"{args.requests * args.batch / wall:,.0f} events/s, p50 {percentile(latencies, 50):.2f} ms, "
+          f"p95 {percentile(latencies, 95):.2f} ms, errors {errors}")
+    server.shutdown()
+
+    print(f"buffered after ingest: {A.event_buffer.stats()['buffered']:,}")
+    t0 = time.perf_counter()
+    flushed = A.event_buffer.drain()
+    print(f"flush (ingested buffer): {flushed:,} events in {time.perf_counter() - t0:.2f}s")
+    for size in args.flush_sizes:
+        events = [A._parse_event(e, None, A.datetime.now(A.timezone.utc)) for e in make_events(rng, size, args.songs)]
+        t0 = time.perf_counter()
+        A.flush_play_events(events)
+        elapsed = time.perf_counter() - t0
+        print(f"flush {size:>7,} events: {elapsed:.2f}s ({size / elapsed:,.0f} events/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Search latency vs. catalog size.
+
+Seeds synthetic catalogs into a throwaway SQLite database (or DATABASE_URL if set)
+and times /api/search through the Flask test client.
+
+    python benchmarks/bench_search.py --sizes 1000 10000 100000 --queries 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from benchlib import percentile, seed_catalog # noqa: E402
+
+QUERIES = ["love", "dar", "alan walk", "hindi night", "sunshin", "moom", "eminem", "rap fire", "retro", "sheeran perf"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    if not os.environ.get('DATABASE_URL'):
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    import app as A
+    A.initialize_app()
+
+    client = A.app.test_client()
+    seeded = 0
+    print(f"{'songs':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for size in sorted(args.sizes):
+        with A.app.app_context():
+            seed_catalog(A, size - seeded, seeded)
+            seeded = size
+        timings = []
+        for i in range(args.queries):
+            q = QUERIES[i % len(QUERIES)]
+            t0 = time.perf_counter()
+            resp = client.get('/api/search', query_string={'q': q, 'limit': 20})
+            timings.append((time.perf_counter() - t0) * 1000)
+            assert resp.status_code == 200
+        print(f"{size:>8} {statistics.median(timings):>8.2f} {percentile(timings, 95):>8.2f} {percentile(timings, 99):>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
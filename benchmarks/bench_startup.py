@@ -0,0 +1,51 @@
+"""
+Worker boot time: before vs. after the startup split.
+
+  before = import app + one-shot init (what every worker used to do on import)
+  after  = import app                 (what a gunicorn worker does now)
+
+Each sample runs in a fresh interpreter against the same pre-initialized SQLite database.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SNIPPETS = {
+    'before': "import app, google.generativeai; app.initialize_app()",
+    'after': "import app",
+}
+
+
+def run(snippet, env):
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, '-c', snippet], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - t0) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    env.pop('RUN_BACKGROUND_JOBS', None)
+    run("import app; app.initialize_app()", env) # Warm: schema + first scan
+
+    print(f"{'mode':>8} {'median ms':>10} {'min ms':>8}")
+    for name, snippet in SNIPPETS.items():
+        timings = [run(snippet, env) for _ in range(args.runs)]
+        print(f"{name:>8} {statistics.median(timings):>10.1f} {min(timings):>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
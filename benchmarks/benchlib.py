@@ -0,0 +1,83 @@
+"""Shared helpers for the benchmark scripts: synthetic seeding (through the app's models) and stats."""
+import json
+import os
+import random
+import re
+import time
+import types
+
+WORDS = ["love", "night", "dance", "alone", "dark", "side", "moon", "fire", "rain", "heart",
+         "sunshine", "dream", "city", "summer", "shadow", "road", "river", "gold", "story", "life"]
+ARTISTS = ["Alan Walker", "Ed Sheeran", "Drake", "Arijit Singh", "Maroon 5", "Eminem",
+           "Frank Sinatra", "Shreya Ghoshal", "Post Malone", "John Legend"]
+CATEGORIES = ["Hindi", "English/Modern", "English/Rap", "English/Romantic", "English/Retro Classics"]
+BATCH = 5000
+STUB_MODEL_DELAY = float(os.environ.get('STUB_MODEL_DELAY', 0.2))
+
+
+class StubModel:
+    """Stands in for the Gemini model: waits, then picks the first ids offered in the prompt."""
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(STUB_MODEL_DELAY)
+        ids = re.findall(r'"id": (\d+)', prompt)[:10]
+        return types.SimpleNamespace(text=json.dumps([int(i) for i in ids]))
+
+
+def seed_catalog(A, n, offset=0):
+    """Adds n songs (ids continue after `offset`) and links them into the category system playlists."""
+    rng = random.Random(offset + n)
+    playlist_ids = dict(A.db.session.query(A.Playlist.name, A.Playlist.id).filter_by(is_system=True).all())
+    for name in {part for c in CATEGORIES for part in c.split('/')} - set(playlist_ids):
+        playlist = A.Playlist(name=name, is_system=True)
+        A.db.session.add(playlist)
+        A.db.session.flush()
+        playlist_ids[name] = playlist.id
+
+    for start in range(0, n, BATCH):
+        rows, categories = [], []
+        for i in range(start, min(n, start + BATCH)):
+            artist = rng.choice(ARTISTS)
+            title = ' '.join(rng.sample(WORDS, 3)).title() + f" {offset + i}"
+            category = rng.choice(CATEGORIES)
+            categories.append(category)
+            rows.append({'title': title, 'artist': artist, 'src': f"/assets/music/{category}/{artist} - {title}.mp3",
+                         'cover': "/assets/default_cover.jpg"})
+        A.db.session.execute(A.insert(A.Song), rows)
+        ids = dict(A.db.session.query(A.Song.src, A.Song.id).filter(A.Song.src.in_([r['src'] for r in rows])).all())
+        links = [{'playlist_id': playlist_ids[part], 'song_id': ids[row['src']]}
+                 for row, category in zip(rows, categories) for part in category.split('/')]
+        A.db.session.execute(A.insert(A.PlaylistSong), links)
+    A.bump_library_version()
+    A.db.session.commit()
+
+
+def seed_users(A, n_users, password, likes_per_user=50, playlists_per_user=3, songs_per_playlist=30):
+    """Adds bench users (bench<i>@example.com) with likes and playlists. Returns their ids."""
+    rng = random.Random(n_users)
+    hashed = A.hash_password(password) # One hash, shared
+    song_ids = [sid for (sid,) in A.db.session.query(A.Song.id)]
+    existing = {email for (email,) in A.db.session.query(A.User.email).filter(A.User.email.like('bench%@example.com'))}
+
+    new_users = [A.User(name=f"Bench {i}", email=f"bench{i}@example.com", password=hashed)
+                 for i in range(n_users) if f"bench{i}@example.com" not in existing]
+    A.db.session.add_all(new_users)
+    A.db.session.flush()
+
+    likes, playlist_links = [], []
+    for user in new_users:
+        likes += [{'user_id': user.id, 'song_id': sid} for sid in rng.sample(song_ids, min(likes_per_user, len(song_ids)))]
+        for p in range(playlists_per_user):
+            playlist = A.Playlist(name=f"Mix {p}", user_id=user.id)
+            A.db.session.add(playlist)
+            A.db.session.flush()
+            playlist_links += [{'playlist_id': playlist.id, 'song_id': sid}
+                               for sid in rng.sample(song_ids, min(songs_per_playlist, len(song_ids)))]
+    if likes: A.db.session.execute(A.insert(A.LikedSong), likes)
+    if playlist_links: A.db.session.execute(A.insert(A.PlaylistSong), playlist_links)
+    A.db.session.commit()
+    return [uid for (uid,) in A.db.session.query(A.User.id).filter(A.User.email.like('bench%@example.com'))]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
@@ -0,0 +1,11 @@
+"""WSGI entry for load tests: the real app with the Smart DJ model replaced by a slow local stub."""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import app as A # noqa: E402
+from benchlib import StubModel # noqa: E402
+
+A.model = StubModel()
+app = A.app
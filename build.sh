@@ -14,4 +14,7 @@ npm install
 npm run build
 cd ..
 
+echo "Precompressing Frontend..."
+flask --app app build-static
+
 echo "Build Complete!"
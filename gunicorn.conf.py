@@ -0,0 +1,33 @@
+"""
+gunicorn settings (Procfile: gunicorn -c gunicorn.conf.py app:app).
+
+Default worker class is gthread: every worker process serves GUNICORN_THREADS requests at once,
+so a Smart DJ call waiting seconds on Gemini holds one thread, not a whole worker, and audio,
+catalog and playlist requests keep being served. Env overrides:
+
+  WEB_CONCURRENCY             worker processes (default 2)
+  GUNICORN_THREADS            threads per worker (default 8); the DB pool follows this value
+  GUNICORN_WORKER_CLASS       gthread (default), gevent (pip install gevent psycogreen), or sync
+  GUNICORN_TIMEOUT            seconds before a silent worker is killed and restarted (default 60)
+"""
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = 1 if worker_class == 'sync' else int(os.environ.get('GUNICORN_THREADS', 8)) # threads > 1 turns sync into gthread
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100)) # gevent: concurrent requests per worker
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+if worker_class == 'gevent':
+    # gevent workers run many requests per process: size the DB pool for them, and make
+    # psycopg2 cooperative so a slow query yields instead of blocking the whole worker
+    os.environ.setdefault('DB_POOL_SIZE', str(min(worker_connections, 20)))
+
+    def post_fork(server, worker):
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen not installed: Postgres calls will block gevent workers")
@@ -1,10 +1,7 @@
-from app import app, db, scan_library
+import sys
+from app import initialize_app
 
+# Same as: flask --app app init [--full]
 print("Initializing Database...")
-with app.app_context():
-    db.create_all()
-    print("Database tables created successfully!")
-    
-    print("Scanning Library...")
-    scan_library()
-    print("Library scan complete!")
+initialize_app(full_scan="--full" in sys.argv)
+print("Library scan complete!")
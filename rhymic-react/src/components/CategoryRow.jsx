@@ -1,6 +1,7 @@
 import React, { useEffect, useState, useRef } from 'react';
 import styles from './CategoryRow.module.css';
 import { useMusicStore } from '../store/musicStore';
+import { coverUrl } from '../services/covers';
 import { useAuthStore } from '../store/authStore';
 import { ChevronLeft, ChevronRight, PlusCircle } from 'lucide-react';
 
@@ -88,7 +89,7 @@ const CategoryRow = ({ title, playlistId }) => {
                   <PlusCircle size={18} color="white" />
                </button>
             </div>
-            <img src={song.cover} alt={song.title} className={styles.songCover} />
+            <img src={coverUrl(song, 160)} alt={song.title} className={styles.songCover} loading="lazy" />
             <h4 className={styles.songTitle}>{song.title}</h4>
             <p className={styles.songArtist}>{song.artist}</p>
           </div>
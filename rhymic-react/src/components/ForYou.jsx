@@ -1,12 +1,15 @@
 import React, { useEffect, useState } from 'react';
 import styles from './ForYou.module.css';
 import { useMusicStore } from '../store/musicStore';
+import { coverUrl } from '../services/covers';
 import { PlusCircle } from 'lucide-react'; // Import
 
 const ForYou = () => {
   const allSongs = useMusicStore((state) => state.songs);
   const setCurrentSong = useMusicStore((state) => state.setCurrentSong);
   const fetchSongs = useMusicStore((state) => state.fetchSongs);
+  const recommended = useMusicStore((state) => state.forYou);
+  const fetchForYou = useMusicStore((state) => state.fetchForYou);
   const playlists = useMusicStore((state) => state.playlists);
   const addSongToPlaylist = useMusicStore((state) => state.addSongToPlaylist);
 
@@ -19,11 +22,17 @@ const ForYou = () => {
   }, [allSongs.length, fetchSongs]);
 
   useEffect(() => {
-    if (allSongs.length > 0) {
+    fetchForYou();
+  }, [fetchForYou]);
+
+  useEffect(() => {
+    if (recommended.length > 0) {
+      setForYouSongs(recommended.slice(0, 6));
+    } else if (allSongs.length > 0) {
       const shuffled = [...allSongs].sort(() => 0.5 - Math.random());
       setForYouSongs(shuffled.slice(0, 6));
     }
-  }, [allSongs]);
+  }, [allSongs, recommended]);
 
   const handleAddToPlaylist = (e, songId) => {
     e.stopPropagation();
@@ -39,7 +48,7 @@ const ForYou = () => {
     <div className={styles.forYouContainer}>
       <h2 className={styles.title}>For You</h2>
       <div className={styles.scrollContainer}>
-        {allSongs.length === 0 ? (
+        {forYouSongs.length === 0 ? (
            <p style={{ color: '#718096', fontStyle: 'italic' }}>Loading library...</p>
         ) : (
           forYouSongs.map(song => (
@@ -54,7 +63,7 @@ const ForYou = () => {
                  </button>
               </div>
 
-              <img src={song.cover} alt={song.title} className={styles.songCover} />
+              <img src={coverUrl(song, 160)} alt={song.title} className={styles.songCover} loading="lazy" />
               <h4 className={styles.songTitle}>{song.title}</h4>
               <p className={styles.songArtist}>{song.artist}</p>
             </div>
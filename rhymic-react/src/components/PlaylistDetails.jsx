@@ -2,6 +2,7 @@ import React, { useEffect, useState } from 'react';
 import { useParams } from 'react-router-dom';
 import styles from './PlaylistPage.module.css';
 import { useMusicStore } from '../store/musicStore';
+import { coverUrl } from '../services/covers';
 import { Play, Heart, Music2 } from 'lucide-react';
 import ContextMenu from './ContextMenu';
 
@@ -59,7 +60,7 @@ const PlaylistDetails = () => {
   // --- UPDATED IMAGE LOGIC ---
   // Image: Abstract Vinyl/Music vibe
   const defaultCover = 'https://images.unsplash.com/photo-1614680376593-902f74cf0d41?q=80&w=1000&auto=format&fit=crop';
-  const coverImage = currentPlaylist.songs[0]?.cover || defaultCover;
+  const coverImage = coverUrl(currentPlaylist.songs[0], 230) || defaultCover;
 
   return (
     <div className={styles.pageContainer}>
@@ -102,7 +103,7 @@ const PlaylistDetails = () => {
             >
               <span className={styles.index}>{index + 1}</span>
               <div className={styles.songLeft}>
-                <img src={song.cover} alt={song.title} className={styles.songCover} />
+                <img src={coverUrl(song, 40)} alt={song.title} className={styles.songCover} loading="lazy" />
                 <div className={styles.songInfo}>
                   <h4>{song.title}</h4>
                   <p>{song.artist}</p>
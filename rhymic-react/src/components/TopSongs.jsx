@@ -2,6 +2,7 @@
 import React, { useEffect } from 'react';
 import styles from './TopSongs.module.css';
 import { useMusicStore } from '../store/musicStore';
+import { coverUrl } from '../services/covers';
 import { Play, Heart, PlusCircle } from 'lucide-react'; // <-- Import PlusCircle
 
 const TopSongs = () => {
@@ -67,7 +68,7 @@ const TopSongs = () => {
                 className={`${styles.songItem} ${isActive ? styles.active : ''}`}
               >
                 <div className={styles.songLeft}>
-                  <img src={song.cover} alt={song.title} className={styles.songCover} />
+                  <img src={coverUrl(song, 48)} alt={song.title} className={styles.songCover} loading="lazy" />
                   <div className={styles.songInfo}>
                     <h4>{song.title}</h4>
                     <p>{song.artist}</p>
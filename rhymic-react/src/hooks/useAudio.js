@@ -1,6 +1,19 @@
 // src/hooks/useAudio.js
-import { useEffect, useMemo } from 'react';
+import { useEffect, useMemo, useRef } from 'react';
 import { useMusicStore } from '../store/musicStore';
+import { trackEvent } from '../services/playEvents';
+
+const SKIP_BEFORE_S = 30; // Leaving a song earlier than this counts as a skip
+
+// Lighter encodes on slow or metered connections (Network Information API where the browser has it;
+// the server also reads the Save-Data / ECT / Downlink hints itself).
+const streamUrl = (song) => {
+  const connection = navigator.connection;
+  let quality = null;
+  if (connection?.saveData || ['slow-2g', '2g'].includes(connection?.effectiveType)) quality = 'low';
+  else if (connection?.effectiveType === '3g') quality = 'medium';
+  return `/api/stream/${song.id}${quality ? `?quality=${quality}` : ''}`;
+};
 
 export const useAudio = () => {
   const audio = useMemo(() => new Audio(), []);
@@ -23,9 +36,16 @@ export const useAudio = () => {
   }, [audio, setAudioElement]);
 
   // Effect 2: Load a new song
+  const lastSong = useRef(null);
   useEffect(() => {
+    const previous = lastSong.current;
+    if (previous && previous !== currentSong && !audio.ended && audio.currentTime < SKIP_BEFORE_S) {
+      trackEvent('skip', previous, audio.currentTime);
+    }
+    lastSong.current = currentSong;
     if (currentSong) {
-      audio.src = currentSong.src;
+      trackEvent('play', currentSong, 0);
+      audio.src = streamUrl(currentSong);
       // Set volume one time on load from the store's state
       audio.volume = useMusicStore.getState().volume;
       audio.load();
@@ -74,8 +94,12 @@ export const useAudio = () => {
     const handleLoadedMetadata = () => {
       setDuration(audio.duration);
     };
+    const handleSeeked = () => {
+      trackEvent('seek', useMusicStore.getState().currentSong, audio.currentTime);
+    };
     const handleEnded = () => {
-      const { nextSong, repeat } = useMusicStore.getState();
+      const { nextSong, repeat, currentSong } = useMusicStore.getState();
+      trackEvent('complete', currentSong, audio.duration);
       if (!repeat) { // Only go to next song if repeat is off
         nextSong();
       }
@@ -84,11 +108,13 @@ export const useAudio = () => {
     audio.addEventListener('timeupdate', handleTimeUpdate);
     audio.addEventListener('loadedmetadata', handleLoadedMetadata);
     audio.addEventListener('ended', handleEnded);
+    audio.addEventListener('seeked', handleSeeked);
 
     return () => {
       audio.removeEventListener('timeupdate', handleTimeUpdate);
       audio.removeEventListener('loadedmetadata', handleLoadedMetadata);
       audio.removeEventListener('ended', handleEnded);
+      audio.removeEventListener('seeked', handleSeeked);
     };
   }, [audio, setCurrentTime, setDuration, setIsPlaying]);
 
@@ -0,0 +1,10 @@
+// src/services/covers.js
+// Song payloads carry square WebP thumbnails as `covers: { "96": url, "320": url, ... }` (COVER_SIZES in app.py).
+// Pick the smallest one that stays sharp at the displayed size; fall back to the original art.
+export const coverUrl = (song, cssPx) => {
+  const covers = song?.covers;
+  if (!covers) return song?.cover;
+  const wanted = cssPx * (window.devicePixelRatio || 1);
+  const sizes = Object.keys(covers).map(Number).sort((a, b) => a - b);
+  return covers[sizes.find((size) => size >= wanted) ?? sizes[sizes.length - 1]];
+};
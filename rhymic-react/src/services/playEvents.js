@@ -0,0 +1,33 @@
+// src/services/playEvents.js
+// Batches player events (play / skip / seek / complete) and posts them to /api/events.
+const FLUSH_MS = 10000;
+const MAX_QUEUE = 50;
+
+let queue = [];
+let timer = null;
+
+export const flushEvents = () => {
+  if (timer) { clearTimeout(timer); timer = null; }
+  if (queue.length === 0) return;
+  const events = queue;
+  queue = [];
+  const token = localStorage.getItem('token');
+  fetch('/api/events', {
+    method: 'POST',
+    keepalive: true, // Still delivered if the tab is closing
+    headers: {
+      'Content-Type': 'application/json',
+      ...(token ? { 'Authorization': `Bearer ${token}` } : {}),
+    },
+    body: JSON.stringify({ events }),
+  }).catch(() => {}); // Analytics only: never bother the player with failures
+};
+
+export const trackEvent = (type, song, position) => {
+  if (!song) return;
+  queue.push({ type, song_id: song.id, position: Math.round((position || 0) * 10) / 10, ts: Date.now() / 1000 });
+  if (queue.length >= MAX_QUEUE) flushEvents();
+  else if (!timer) timer = setTimeout(flushEvents, FLUSH_MS);
+};
+
+window.addEventListener('pagehide', flushEvents);
@@ -21,6 +21,7 @@ export const useMusicStore = create((set, get) => ({
   songs: [],
   currentSong: null,
   likedSongs: [],
+  forYou: [],
   playlists: [],
   currentPlaylist: null,
   volume: 1,
@@ -64,6 +65,20 @@ export const useMusicStore = create((set, get) => ({
     }
   },
 
+  fetchForYou: async () => {
+    const token = localStorage.getItem('token');
+    if (!token) return;
+    try {
+      const response = await fetch('/api/recommendations?limit=12', {
+        headers: { 'Authorization': `Bearer ${token}` }
+      });
+      await handleResponse(response);
+      set({ forYou: await response.json() });
+    } catch (error) {
+      set({ forYou: [] }); // ForYou falls back to a shuffle of the catalog
+    }
+  },
+
   toggleLike: async (songId) => {
     const token = localStorage.getItem('token');
     if (!token) {
@@ -3,6 +3,9 @@ import react from '@vitejs/plugin-react'
 
 export default defineConfig({
   plugins: [react()],
+  build: {
+    manifest: true, // dist/.vite/manifest.json: tells the Flask server which files are content-hashed
+  },
   server: {
     proxy: {
       '/api': {
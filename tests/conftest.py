@@ -0,0 +1,87 @@
+"""
+Shared fixtures. The app module reads its config at import time, so the environment is set
+before `import app`: a throwaway SQLite database, inline bcrypt at the lowest cost, no rate
+limits and no AI key. Every test starts from empty tables and cold in-process caches.
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP = tempfile.mkdtemp(prefix='rhymic-tests-')
+
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(TMP, 'test.db')}",
+    'SECRET_KEY': 'test-secret-key-of-at-least-32-bytes',
+    'GOOGLE_API_KEY': '', # Set (empty) so a local .env can't switch the real model on
+    'AUTH_HASH_WORKERS': '0',
+    'BCRYPT_ROUNDS': '4',
+    'RATELIMIT_ENABLED': '0',
+    'BLOB_STORE': 'db',
+    'RUN_BACKGROUND_JOBS': '0',
+})
+sys.path.insert(0, ROOT)
+
+import app as rhymic # noqa: E402
+
+rhymic.app.instance_path = TMP # init.lock and any local blobs stay out of the repo
+rhymic.ASSETS_DIR = os.path.join(TMP, 'assets')
+rhymic.initialize_app()
+
+_song_numbers = itertools.count(1)
+
+@pytest.fixture
+def app_module():
+    """The app module with emptied tables, a fresh library version and cleared caches."""
+    with rhymic.app.app_context():
+        for table in reversed(rhymic.db.metadata.sorted_tables):
+            if table.name != 'library_state': # Kept: versions must only move forward (cache keys)
+                rhymic.db.session.execute(table.delete())
+        rhymic.bump_library_version()
+        rhymic.db.session.commit()
+    with rhymic._user_cache_lock:
+        rhymic._user_cache.clear()
+    with rhymic._artist_lock:
+        rhymic._artist_lru.clear()
+        rhymic._artist_pending.clear()
+    rhymic.model = None
+    yield rhymic
+    rhymic.model = None
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+@pytest.fixture
+def make_songs(app_module):
+    """make_songs(n, playlist=None) -> song ids; rows are inserted directly (no files on disk)."""
+    def make(n, playlist=None, artist='Artist'):
+        with app_module.app.app_context():
+            numbers = [next(_song_numbers) for _ in range(n)]
+            songs = [app_module.Song(title=f"Song {i}", artist=f"{artist} {i % 5}", src=f"/assets/music/test/{i}.mp3") for i in numbers]
+            app_module.db.session.add_all(songs)
+            app_module.db.session.flush()
+            if playlist is not None:
+                p = app_module.Playlist.query.filter_by(name=playlist).first()
+                if p is None:
+                    p = app_module.Playlist(name=playlist, is_system=True)
+                    app_module.db.session.add(p)
+                    app_module.db.session.flush()
+                app_module.db.session.add_all(app_module.PlaylistSong(playlist_id=p.id, song_id=s.id) for s in songs)
+            app_module.bump_library_version()
+            app_module.db.session.commit()
+            return [s.id for s in songs]
+    return make
+
+@pytest.fixture
+def user(app_module):
+    """A saved user; returns (id, auth headers)."""
+    with app_module.app.app_context():
+        u = app_module.User(name='Tester', email='tester@example.com', password=app_module.hash_password('secret-pw'))
+        app_module.db.session.add(u)
+        app_module.db.session.commit()
+        token = app_module.create_access_token(identity=str(u.id))
+        return u.id, {'Authorization': f"Bearer {token}"}
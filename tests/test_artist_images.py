@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+KNOWN = {'Arijit Singh': 'https://img.example/arijit.jpg'}
+
+@pytest.fixture
+def deezer(app_module, monkeypatch):
+    """Local stand-in for the Deezer search API; returns the list of names it was asked for."""
+    queries = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            name = parse_qs(urlparse(self.path).query)['q'][0]
+            queries.append(name)
+            data = [{'picture_xl': KNOWN[name]}] if name in KNOWN else []
+            body = json.dumps({'data': data}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    monkeypatch.setattr(app_module, 'DEEZER_API_URL', f"http://127.0.0.1:{server.server_address[1]}")
+    yield queries
+    server.shutdown()
+
+@pytest.fixture
+def library(app_module):
+    with app_module.app.app_context():
+        app_module.db.session.add_all([
+            app_module.Song(title='Tum Hi Ho', artist='Arijit Singh', src='/assets/music/a/1.mp3'),
+            app_module.Song(title='Demo', artist='Garage Band', src='/assets/music/a/2.mp3'),
+        ])
+        app_module.db.session.commit()
+
+def image_url(client, name):
+    resp = client.get('/api/artist_image', query_string={'name': name})
+    assert resp.status_code == 200
+    return resp.get_json()['image_url']
+
+def settle(app_module):
+    deadline = time.monotonic() + 5
+    while app_module._artist_pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not app_module._artist_pending
+
+def test_hit_is_fetched_once_in_the_background(client, app_module, deezer, library):
+    assert image_url(client, 'Arijit Singh') == app_module.DEFAULT_ARTIST_IMAGE # Never waits on the network
+    settle(app_module)
+    assert image_url(client, 'Arijit Singh') == KNOWN['Arijit Singh']
+    with app_module._artist_lock:
+        app_module._artist_lru.clear() # Next lookup comes from the ArtistImage table
+    assert image_url(client, 'Arijit Singh') == KNOWN['Arijit Singh']
+    assert deezer == ['Arijit Singh']
+
+def test_miss_is_negatively_cached_until_the_ttl_expires(client, app_module, deezer, library, monkeypatch):
+    monkeypatch.setattr(app_module, 'ARTIST_NEGATIVE_TTL', 0.3)
+    image_url(client, 'Garage Band')
+    settle(app_module)
+    for _ in range(3):
+        assert image_url(client, 'Garage Band') == app_module.DEFAULT_ARTIST_IMAGE
+    settle(app_module)
+    assert deezer == ['Garage Band']
+
+    time.sleep(0.4)
+    image_url(client, 'Garage Band')
+    settle(app_module)
+    assert deezer == ['Garage Band', 'Garage Band']
+
+def test_names_outside_the_library_are_never_fetched(client, app_module, deezer, library):
+    for i in range(20):
+        assert image_url(client, f"Random Name {i}") == app_module.DEFAULT_ARTIST_IMAGE
+    settle(app_module)
+    assert deezer == []
+    with app_module.app.app_context():
+        assert app_module.ArtistImage.query.count() == 0
+
+    assert client.get('/api/artist_image', query_string={'name': 'x' * 101}).status_code == 400
+    assert client.get('/api/artist_image').status_code == 400
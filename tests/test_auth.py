@@ -0,0 +1,52 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+def test_signup_login_and_rehash(client, app_module, monkeypatch):
+    resp = client.post('/api/signup', json={'name': 'Ann', 'email': 'ann@example.com', 'password': 'long-enough-pw'})
+    assert resp.status_code == 201
+    assert client.post('/api/login', json={'email': 'ann@example.com', 'password': 'wrong'}).status_code == 401
+
+    monkeypatch.setattr(app_module, 'BCRYPT_ROUNDS', 5)
+    resp = client.post('/api/login', json={'email': 'ann@example.com', 'password': 'long-enough-pw'})
+    assert resp.status_code == 200 and resp.get_json()['token']
+    with app_module.app.app_context():
+        stored = app_module.User.query.filter_by(email='ann@example.com').one().password
+    assert app_module.password_cost(stored) == 5
+
+@pytest.fixture
+def slow_pool(app_module, monkeypatch):
+    """One-slot hash queue backed by a thread pool, with a short timeout."""
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(app_module, 'AUTH_HASH_WORKERS', 1)
+    monkeypatch.setattr(app_module, 'AUTH_HASH_TIMEOUT', 0.2)
+    monkeypatch.setattr(app_module, '_hash_slots', threading.BoundedSemaphore(1))
+    monkeypatch.setattr(app_module, '_get_hash_pool', lambda: pool)
+    yield pool
+    pool.shutdown(wait=True)
+
+def test_hash_timeout_is_busy_and_keeps_its_slot(app_module, slow_pool):
+    release = threading.Event()
+    with pytest.raises(app_module.AuthBusy):
+        app_module._run_hash(release.wait, 5)
+    # The timed-out hash is still running, so the only slot is still taken
+    with pytest.raises(app_module.AuthBusy):
+        app_module._run_hash(lambda: 'ok')
+    release.set()
+    deadline = time.monotonic() + 2
+    while time.monotonic() < deadline:
+        try:
+            assert app_module._run_hash(lambda: 'ok') == 'ok'
+            break
+        except app_module.AuthBusy:
+            continue
+    else:
+        pytest.fail('slot was never released')
+
+def test_login_timeout_returns_503(client, app_module, user, slow_pool, monkeypatch):
+    monkeypatch.setattr(app_module.bcrypt, 'checkpw', lambda *args: time.sleep(0.5) or True)
+    resp = client.post('/api/login', json={'email': 'tester@example.com', 'password': 'secret-pw'})
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '1'
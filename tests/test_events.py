@@ -0,0 +1,56 @@
+def post_events(client, events):
+    return client.post('/api/events', json={'events': events})
+
+def test_events_are_buffered_and_flushed(client, app_module, make_songs):
+    sid, = make_songs(1)
+    resp = post_events(client, [{'type': 'play', 'song_id': sid, 'position': 3.5}, {'type': 'skip', 'song_id': sid}])
+    assert resp.status_code == 202 and resp.get_json() == {'accepted': 2}
+    app_module.event_buffer.drain()
+    with app_module.app.app_context():
+        stats = app_module.SongDailyStats.query.filter_by(song_id=sid).one()
+        assert (stats.plays, stats.skips) == (1, 1)
+
+def test_out_of_range_events_are_rejected(client, app_module, make_songs):
+    sid, = make_songs(1)
+    before = app_module.event_buffer.stats()['accepted']
+    for bad in ({'type': 'play', 'song_id': 10**30}, {'type': 'play', 'song_id': -1},
+                {'type': 'play', 'song_id': sid, 'position': 10**400}, {'type': 'play', 'song_id': sid, 'position': 'x'},
+                {'type': 'rewind', 'song_id': sid}):
+        resp = post_events(client, [{'type': 'play', 'song_id': sid}, bad])
+        assert resp.status_code == 400
+        assert resp.get_json()['invalid'] == [1]
+    assert app_module.event_buffer.stats()['accepted'] == before
+
+def test_failing_batch_is_given_up_without_blocking_new_events(app_module, make_songs):
+    sid, = make_songs(1)
+    calls = []
+    def flush(events):
+        calls.append(len(events))
+        if any(e.get('poison') for e in events): raise ValueError('bad row')
+        app_module.flush_play_events(events)
+
+    buffer = app_module.EventBuffer(flush, interval=3600, flush_size=10**6, max_size=100)
+    buffer._thread = object() # Drained by hand below, no flusher thread
+    now = app_module.datetime.now(app_module.timezone.utc)
+    event = app_module._parse_event({'type': 'play', 'song_id': sid}, None, now)
+    buffer.add([{**event, 'poison': True}] * 3)
+    buffer.drain()
+
+    for _ in range(app_module.EVENTS_FLUSH_RETRIES - 1): # Retried on its own next to fresh events
+        buffer.add([event])
+        buffer.drain()
+
+    stats = buffer.stats()
+    assert stats['failed'] == 3 # Each given-up event counted once
+    assert stats['flushed'] == app_module.EVENTS_FLUSH_RETRIES - 1
+    assert stats['buffered'] == 0
+    assert calls.count(3) == app_module.EVENTS_FLUSH_RETRIES
+
+def test_drain_flushes_in_chunks_of_flush_size(app_module):
+    calls = []
+    buffer = app_module.EventBuffer(lambda events: calls.append(len(events)), interval=3600, flush_size=4, max_size=100)
+    buffer._thread = object()
+    buffer.add([{'n': i} for i in range(10)])
+    assert buffer.drain() == 10
+    assert calls == [4, 4, 2]
+    assert buffer.stats()['flushed'] == 10
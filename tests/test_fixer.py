@@ -0,0 +1,55 @@
+import json
+import re
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+class FlakyModel:
+    """Answers for every other offered file; fails outright for batches that contain `down` ids."""
+    def __init__(self, down=()):
+        self.down = set(down)
+
+    def generate_content(self, prompt, **kwargs):
+        offered = [int(i) for i in re.findall(r'"id": (\d+)', prompt)]
+        if self.down & set(offered):
+            raise RuntimeError("503 model unavailable")
+        rows = [{'id': sid, 'artist': f"Fixed {sid}", 'title': f"Title {sid}"} for sid in offered[::2]]
+        return types.SimpleNamespace(text=json.dumps(rows))
+
+@pytest.fixture
+def messy(app_module, make_songs, monkeypatch):
+    monkeypatch.setattr(app_module, 'FIXER_BATCH_SIZE', 4)
+    monkeypatch.setattr(app_module, 'FIXER_MAX_RETRIES', 2)
+    monkeypatch.setattr(app_module, 'FIXER_BACKOFF_BASE', 0)
+    monkeypatch.setattr(app_module, 'fixer_rate_limiter', app_module.TokenBucket(1000, 1000))
+    ids = make_songs(8)
+    with app_module.app.app_context():
+        app_module.db.session.execute(app_module.update(app_module.Song), [{'id': i, 'artist': "Unknown Artist"} for i in ids])
+        app_module.db.session.commit()
+    return ids
+
+def fix_round(app_module):
+    with app_module.app.app_context(), ThreadPoolExecutor(max_workers=2) as pool:
+        result = app_module.run_metadata_fix_round(pool)
+        artists = dict(app_module.db.session.query(app_module.Song.id, app_module.Song.artist).all())
+    return result, artists
+
+def test_failed_batches_and_unanswered_songs_are_left_for_later(app_module, messy):
+    app_module.model = FlakyModel(down=messy[4:5])
+    (processed, fixed, failed), artists = fix_round(app_module)
+
+    assert (processed, fixed, failed) == (2, 2, 1)
+    assert [artists[i] for i in messy[:4]] == [f"Fixed {messy[0]}", "Unknown Artist", f"Fixed {messy[2]}", "Unknown Artist"]
+    assert all(artists[i] == "Unknown Artist" for i in messy[4:]) # Failed batch untouched, not "AI Checked"
+
+def test_outage_writes_nothing(app_module, messy):
+    app_module.model = FlakyModel(down=messy)
+    with app_module.app.app_context():
+        version = app_module.current_library_version()
+    (processed, fixed, failed), artists = fix_round(app_module)
+
+    assert (processed, fixed, failed) == (0, 0, 2)
+    assert set(artists.values()) == {"Unknown Artist"}
+    with app_module.app.app_context():
+        assert app_module.current_library_version() == version
@@ -0,0 +1,27 @@
+import pytest
+
+@pytest.mark.parametrize('bad', ["abc", "1", True, 0, -3, 1.5, None, [1]])
+def test_malformed_song_id_is_rejected(client, user, bad):
+    _, headers = user
+    resp = client.post('/api/likes', json={'song_id': bad}, headers=headers)
+    assert resp.status_code == 400
+    pid = client.post('/api/playlists', json={'name': 'Mine'}, headers=headers).get_json()['id']
+    resp = client.post('/api/playlists/add_song', json={'playlist_id': pid, 'song_id': bad}, headers=headers)
+    assert resp.status_code == 400
+
+def test_like_toggles_and_unknown_song_is_404(client, make_songs, user):
+    _, headers = user
+    (sid,) = make_songs(1)
+    assert client.post('/api/likes', json={'song_id': sid}, headers=headers).get_json() == {'status': 'added'}
+    assert client.post('/api/likes', json={'song_id': sid}, headers=headers).get_json() == {'status': 'removed'}
+    assert client.post('/api/likes', json={'song_id': sid + 1000}, headers=headers).status_code == 404
+    assert client.get('/api/likes', headers=headers).get_json() == []
+
+def test_add_song_to_playlist(client, make_songs, user):
+    _, headers = user
+    (sid,) = make_songs(1)
+    pid = client.post('/api/playlists', json={'name': 'Mine'}, headers=headers).get_json()['id']
+    add = lambda song_id: client.post('/api/playlists/add_song', json={'playlist_id': pid, 'song_id': song_id}, headers=headers)
+    assert add(sid).status_code == 200
+    assert add(sid).status_code == 200 # Already there: still fine
+    assert add(sid + 1000).status_code == 404
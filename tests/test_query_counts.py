@@ -0,0 +1,53 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+@pytest.fixture
+def count_queries(app_module):
+    """count_queries() -> context manager collecting the SQL statements run inside it."""
+    @contextmanager
+    def count():
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+        with app_module.app.app_context():
+            engine = app_module.db.engine
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return count
+
+def playlist_id(app_module, name):
+    with app_module.app.app_context():
+        return app_module.Playlist.query.filter_by(name=name).one().id
+
+@pytest.mark.parametrize('n', [3, 40, 400])
+def test_song_listing_query_count_is_constant(client, make_songs, count_queries, n):
+    make_songs(n)
+    with count_queries() as cold:
+        songs = client.get('/api/songs').get_json()
+    with count_queries() as warm:
+        page = client.get('/api/songs?limit=10').get_json()
+    assert len(songs) == n and len(page['songs']) == min(n, 10)
+    assert len(cold) == 2 # library version + one catalog load
+    assert len(warm) == 1 # library version only
+
+@pytest.mark.parametrize('n', [3, 40, 400])
+def test_playlist_query_counts_are_constant(client, app_module, make_songs, user, count_queries, n):
+    _, headers = user
+    ids = make_songs(n, playlist='English')
+    pid = playlist_id(app_module, 'English')
+
+    with count_queries() as listing:
+        assert client.get('/api/playlists', headers=headers).status_code == 200
+    with count_queries() as detail:
+        body = client.get(f'/api/playlists/{pid}', headers=headers).get_json()
+    with count_queries() as paged:
+        page = client.get(f'/api/playlists/{pid}?limit=5&offset=2', headers=headers).get_json()
+
+    assert [s['id'] for s in body['songs']] == ids and body['total'] == n
+    assert [s['id'] for s in page['songs']] == ids[2:7] and page['total'] == n
+    assert (len(listing), len(detail), len(paged)) == (1, 1, 1)
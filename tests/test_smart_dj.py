@@ -0,0 +1,42 @@
+import json
+import re
+import types
+
+class StubModel:
+    """Local stand-in for Gemini: answers with the shortlist reversed, plus an id it was never offered."""
+    def __init__(self):
+        self.prompts = []
+
+    def generate_content(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        offered = [int(i) for i in re.findall(r'"id": (\d+)', prompt)]
+        picked = offered[::-1][:5]
+        return types.SimpleNamespace(text=f"```json\n{json.dumps(picked + [picked[0], 10**6])}\n```")
+
+def recommend(client, headers, prompt):
+    resp = client.post('/api/ai/recommend', json={'prompt': prompt}, headers=headers)
+    assert resp.status_code == 200
+    return resp.get_json()
+
+def test_stub_model_answer_is_hydrated_in_order_and_cached(client, app_module, make_songs, user):
+    _, headers = user
+    make_songs(200)
+    stub = app_module.model = StubModel()
+    before = app_module.recommend_cache.stats()
+
+    songs = recommend(client, headers, 'Songs by Artist 3')
+    offered = [int(i) for i in re.findall(r'"id": (\d+)', stub.prompts[0])]
+    assert len(offered) <= app_module.RECOMMEND_CANDIDATES # Shortlist, not the whole library
+    assert [s['id'] for s in songs] == offered[::-1][:5] # Model order kept; repeats and unknown ids dropped
+    assert all(set(s) == set(app_module.SONG_FIELDS) for s in songs)
+
+    assert recommend(client, headers, '  songs BY artist 3 ') == songs # Same normalized prompt
+    assert len(stub.prompts) == 1
+    after = app_module.recommend_cache.stats()
+    assert (after['misses'] - before['misses'], after['hits'] - before['hits']) == (1, 1)
+
+def test_without_a_model_random_songs_are_returned(client, app_module, make_songs, user):
+    _, headers = user
+    make_songs(30)
+    songs = recommend(client, headers, 'anything')
+    assert len(songs) == 10 and len({s['id'] for s in songs}) == 10
@@ -0,0 +1,47 @@
+import pytest
+
+def test_pagination_walks_the_catalog(client, make_songs):
+    ids = make_songs(25)
+    seen, cursor = [], 0
+    while cursor is not None:
+        body = client.get(f'/api/songs?limit=10&cursor={cursor}&fields=id,title').get_json()
+        assert all(set(s) == {'id', 'title'} for s in body['songs'])
+        seen += [s['id'] for s in body['songs']]
+        cursor = body['next_cursor']
+    assert seen == ids
+
+@pytest.mark.parametrize('query, message', [
+    ('limit=abc', 'Invalid limit'),
+    ('limit=', 'Invalid limit'),
+    ('limit=1.5', 'Invalid limit'),
+    ('limit=10&cursor=x', 'Invalid cursor'),
+    ('fields=id,password', None),
+])
+def test_bad_parameters_are_rejected(client, make_songs, query, message):
+    make_songs(3)
+    resp = client.get(f'/api/songs?{query}')
+    assert resp.status_code == 400
+    if message: assert resp.get_json()['message'] == message
+
+def test_etag_revalidation(client, make_songs):
+    make_songs(3)
+    etag = client.get('/api/songs').headers['ETag']
+    assert client.get('/api/songs', headers={'If-None-Match': etag}).status_code == 304
+    make_songs(1) # New library version
+    assert client.get('/api/songs', headers={'If-None-Match': etag}).status_code == 200
+
+def test_field_projections_are_normalized(client, app_module, make_songs):
+    make_songs(3)
+    variants = ['id', 'id,id', 'id,id,id', 'title,id', 'id,title,id']
+    bodies = [client.get(f'/api/songs?fields={f}') for f in variants]
+    assert [r.get_json() for r in bodies[:3]] == [[{'id': s['id']} for s in bodies[0].get_json()]] * 3
+    assert bodies[3].get_json() == bodies[4].get_json()
+    assert bodies[0].headers['ETag'] == bodies[2].headers['ETag']
+    assert bodies[3].headers['ETag'] == bodies[4].headers['ETag']
+    assert len(app_module._catalog_cache['bodies']) == 2 # ('id',) and ('id', 'title')
+
+def test_search_results_have_the_song_shape(client, app_module, make_songs):
+    make_songs(3, artist='Searchable')
+    results = client.get('/api/search?q=searchable').get_json()
+    assert len(results) == 3
+    assert all(set(s) == set(app_module.SONG_FIELDS) for s in results)
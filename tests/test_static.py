@@ -0,0 +1,43 @@
+import json
+import os
+
+import pytest
+
+def write(root, rel, data=b'x'):
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+@pytest.fixture
+def dist(tmp_path):
+    root = str(tmp_path)
+    for rel in ('index.html', 'assets/index-BkT3a9Qz.js', 'assets/index-Dq1_x-Zc.css', 'assets/logo-C4xQ9mZ2.png',
+                'assets/cover-artwork1.png', 'assets/default_cover.jpg', 'assets/music/Rock/a.mp3'):
+        write(root, rel)
+    return root
+
+def test_vite_manifest_decides_what_is_immutable(app_module, dist):
+    write(dist, app_module.VITE_MANIFEST, json.dumps({
+        'index.html': {'file': 'assets/index-BkT3a9Qz.js', 'css': ['assets/index-Dq1_x-Zc.css'],
+                       'assets': ['assets/logo-C4xQ9mZ2.png'], 'isEntry': True},
+    }).encode('utf-8'))
+    files = app_module.scan_dist(dist)
+    immutable = {rel for rel, entry in files.items() if entry['immutable']}
+    assert immutable == {'assets/index-BkT3a9Qz.js', 'assets/index-Dq1_x-Zc.css', 'assets/logo-C4xQ9mZ2.png'}
+    assert not any(rel.startswith(('.vite/', 'assets/music/')) for rel in files)
+
+def test_without_a_manifest_only_vite_shaped_chunks_are_immutable(app_module, dist):
+    files = app_module.scan_dist(dist)
+    immutable = {rel for rel, entry in files.items() if entry['immutable']}
+    assert immutable == {'assets/index-BkT3a9Qz.js', 'assets/index-Dq1_x-Zc.css'}
+    assert not files['assets/cover-artwork1.png']['immutable']
+
+def test_library_art_is_revalidated_not_immutable(client, app_module):
+    write(app_module.ASSETS_DIR, 'music/Rock/cover.jpg', b'art v1')
+    resp = client.get('/assets/music/Rock/cover.jpg')
+    assert resp.status_code == 200
+    assert 'immutable' not in resp.headers['Cache-Control'] and 'max-age=86400' in resp.headers['Cache-Control']
+
+    again = client.get('/assets/music/Rock/cover.jpg', headers={'If-None-Match': resp.headers['ETag']})
+    assert again.status_code == 304
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+@pytest.fixture
+def pending_songs(app_module, make_songs, monkeypatch):
+    """Five songs waiting for the transcoder, with ffmpeg replaced by a stub (one 64k variant each)."""
+    ids = make_songs(5)
+    with app_module.app.app_context():
+        app_module.db.session.add_all(app_module.LibraryFile(path=s.src, mtime=1.0, size=1)
+                                      for s in app_module.Song.query.filter(app_module.Song.id.in_(ids)))
+        app_module.db.session.commit()
+
+    encoded = []
+    def fake_transcode(fs_path, song_id):
+        encoded.append(song_id)
+        return {'duration': 180.0, 'loudness': -14.0,
+                'variants': [{'bitrate': 64, 'codec': 'aac', 'path': f"{song_id}-64k.m4a", 'size': 1, 'mtime': 1.0}]}
+    monkeypatch.setattr(app_module, 'ffmpeg_available', lambda: True)
+    monkeypatch.setattr(app_module, 'transcode_file', fake_transcode)
+    monkeypatch.setattr(app_module, 'TRANSCODE_WORKERS', 1)
+    return encoded
+
+def test_lease_is_renewed_after_every_song(app_module, pending_songs, monkeypatch):
+    renewals = []
+    real_acquire = app_module.acquire_lease
+    monkeypatch.setattr(app_module, 'acquire_lease', lambda name, ttl: renewals.append(ttl) or real_acquire(name, ttl))
+    with app_module.app.app_context():
+        stats = app_module.transcode_library(lease=app_module.TRANSCODE_JOB)
+        assert app_module.SongVariant.query.count() == 5
+    assert stats['songs'] == 5 and not stats.get('lease_lost')
+    assert renewals == [app_module.TRANSCODE_LEASE_TTL] * 5
+
+def test_batch_stops_when_the_lease_is_lost(app_module, pending_songs, monkeypatch):
+    monkeypatch.setattr(app_module, 'acquire_lease', lambda name, ttl: False) # Another worker took over
+    with app_module.app.app_context():
+        stats = app_module.transcode_library(lease=app_module.TRANSCODE_JOB)
+        done = app_module.LibraryFile.query.filter(app_module.LibraryFile.transcoded_mtime.isnot(None)).count()
+    assert stats['lease_lost'] and stats['songs'] == 1
+    assert done == 1 # Nothing written after the lease was lost; the rest is left for the new leader
+
+def test_missing_variant_file_streams_the_original_and_requeues_the_song(client, app_module, pending_songs, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, 'TRANSCODE_DIR', str(tmp_path)) # Worker wrote its variants elsewhere
+    with app_module.app.app_context():
+        app_module.transcode_library()
+        song = app_module.Song.query.order_by(app_module.Song.id).first()
+        app_module.LibraryFile.query.filter_by(path=song.src).update({'size': 4_000_000}) # ~180 kbps source
+        app_module.db.session.commit()
+        src_path = app_module._asset_fs_path(song.src)
+    os.makedirs(os.path.dirname(src_path), exist_ok=True)
+    with open(src_path, 'wb') as f: f.write(b'x')
+
+    resp = client.get(f"/api/stream/{song.id}?quality=low")
+    assert resp.status_code == 200 and resp.data == b'x'
+    with app_module.app.app_context():
+        assert app_module.LibraryFile.query.filter_by(path=song.src).one().transcoded_mtime is None
+        del pending_songs[:]
+        app_module.transcode_library()
+    assert pending_songs == [song.id]